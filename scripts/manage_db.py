@@ -5,39 +5,58 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
 
 try:
     from src import config
-    from src.core.pipeline import add_to_indices
+    from src.core.pipeline import add_to_indices, persist_indices
+    from src.core.manifest import IndexManifest
+    from src.utils.digest import file_digest
 except ImportError as e:
     print(f"Error importing modules: {e}")
     sys.exit(1)
 
+def checkpoint(manifest):
+    persist_indices()
+    manifest.commit()
+
 def main():
     images_dir = config.IMAGE_DIR
     uploads_dir_path = config.UPLOAD_DIR
-    
+
     if not images_dir.exists():
         print(f"Error: Images directory not found at {images_dir}")
         return
 
     print(f"Scanning for images in: {images_dir}")
     print(f"Ignoring uploads folder: {uploads_dir_path}")
-    
+
+    manifest = IndexManifest()
     count = 0
+    skipped = 0
     valid_extensions = {'.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tiff'}
 
     for root, dirs, files in os.walk(images_dir):
         if 'uploads' in dirs:
             dirs.remove('uploads')
-            
+
         for file in files:
             ext = os.path.splitext(file)[1].lower()
             if ext in valid_extensions:
-                file_path = os.path.join(root, file)
+                file_path = os.path.join(root, file).replace('\\', '/')
+                if not manifest.needs_indexing(file_path):
+                    skipped += 1
+                    continue
+
+                stat = os.stat(file_path)
+                digest = file_digest(file_path)
                 success = add_to_indices(file_path)
-                
+
                 if success:
+                    manifest.record(file_path, stat.st_size, stat.st_mtime_ns, digest)
                     count += 1
+                    if count % config.INDEX_CHECKPOINT_EVERY == 0:
+                        checkpoint(manifest)
 
-    print(f"\nFinished. Total images added/processed: {count}")
+    checkpoint(manifest)
+    manifest.close()
+    print(f"\nFinished. Total images added/processed: {count} ({skipped} unchanged, skipped)")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,80 @@
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+from src import config
+from src.core.index_manager import IndexShardManager
+from src.core.catalog import ImageCatalog
+from src.models import projection as pr
+
+DENSE_INDICES = {
+    "clip": config.CLIP_DIM,
+    "dino": config.DINO_DIM,
+}
+
+HASH_INDICES = {
+    "phash": config.PHASH_BITS,
+    "whash": config.WHASH_BITS,
+}
+
+DENSE_TYPES = ["flat", "ivf", "ivfpq", "hnsw", "sq8", "pq", "fp16"]
+HASH_TYPES = ["binary", "binary_mih"]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Rebuild existing shards as another index type.")
+    parser.add_argument("--index", choices=["clip", "dino", "phash", "whash", "dense", "hash"], default="dense")
+    parser.add_argument("--type", choices=DENSE_TYPES + HASH_TYPES,
+                        help="Target index type (default: DENSE_INDEX_TYPE / HASH_INDEX_TYPE from src/config.py)")
+    parser.add_argument("--pca", type=int, nargs="?", const=config.PCA_DIM,
+                        help="Train a PCA projection for CLIP/DINO and project the shards to this many dims (default: PCA_DIM)")
+    parser.add_argument("--whiten", action="store_true", default=config.PCA_WHITEN, help="Whiten the PCA output")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    if args.index == "dense":
+        names = list(DENSE_INDICES)
+    elif args.index == "hash":
+        names = list(HASH_INDICES)
+    else:
+        names = [args.index]
+
+    catalog = ImageCatalog()
+
+    for name in names:
+        is_hash = name in HASH_INDICES
+        index_type = args.type or (config.HASH_INDEX_TYPE if is_hash else config.DENSE_INDEX_TYPE)
+        if index_type not in (HASH_TYPES if is_hash else DENSE_TYPES):
+            print(f"Index type {index_type} does not apply to {name}, skipping")
+            continue
+
+        dimension = HASH_INDICES[name] if is_hash else pr.output_dim(name, DENSE_INDICES[name])
+        print(f"\nMigrating {name} shards to {index_type}...")
+        manager = IndexShardManager(str(config.INDEX_DIR), name, dimension, index_type=index_type, catalog=catalog)
+
+        if args.pca and not is_hash:
+            if pr.get_projection(name) is not None:
+                print(f"{name} shards are already projected to {dimension} dims, skipping PCA")
+            else:
+                sample = manager.sample(config.ANN_TRAIN_SIZE)
+                if sample is None:
+                    print(f"{name}: no vectors to train the projection on")
+                    continue
+                projection = pr.train_projection(name, sample, args.pca, whiten=args.whiten)
+                manager.project_shards(projection)
+                # Saved last: the engines only start projecting once the shards match.
+                projection.save(name)
+
+        manager.rebuild_shards()
+        manager.persist()
+
+        configured = config.HASH_INDEX_TYPE if is_hash else config.DENSE_INDEX_TYPE
+        if index_type != configured:
+            setting = "HASH_INDEX_TYPE" if is_hash else "DENSE_INDEX_TYPE"
+            print(f"Remember to set {setting} = \"{index_type}\" in src/config.py")
+
+if __name__ == "__main__":
+    main()
@@ -8,8 +8,10 @@ INDEX_DIR = DATA_DIR / "indices"
 MODEL_DIR = DATA_DIR / "models"
 IMAGE_DIR = DATA_DIR / "images"
 UPLOAD_DIR = IMAGE_DIR / "uploads"
+CACHE_DIR = DATA_DIR / "cache"
+WAL_DIR = INDEX_DIR / "wal"
 
-for directory in [DATA_DIR, INDEX_DIR, MODEL_DIR, IMAGE_DIR, UPLOAD_DIR]:
+for directory in [DATA_DIR, INDEX_DIR, MODEL_DIR, IMAGE_DIR, UPLOAD_DIR, CACHE_DIR, WAL_DIR]:
     directory.mkdir(parents=True, exist_ok=True)
 
 
@@ -33,3 +35,106 @@ CLIP_THRESHOLD = 0.59
 DINO_THRESHOLD = 0.55
 HIST_THRESHOLD = 0.80
 STRUCTURE_CHECK_THRESHOLD = 3
+
+
+# Decompression-bomb guard: images above this many pixels are rejected before decoding
+MAX_IMAGE_PIXELS = 100_000_000
+# Hashes are always computed from a decode at the smallest 1/2-1/8 JPEG scale still this large (px),
+# whatever size the entry point decodes for its other stages
+HASH_DECODE_SIZE = 128
+
+EMBED_BATCH_SIZE = 32
+EMBED_MEMORY_BUDGET_MB = 2048
+
+INDEX_WORKERS = os.cpu_count() or 1
+INDEX_QUEUE_SIZE = 1024
+INDEX_CHECKPOINT_EVERY = 10000
+INDEX_REPORT_SECONDS = 10
+
+# Dense (CLIP/DINO) index type: "flat" (exact), "ivf", "ivfpq", "hnsw", "sq8", "pq" or "fp16"
+DENSE_INDEX_TYPE = "flat"
+ANN_TRAIN_SIZE = 100000
+IVF_NLIST = 1024
+IVF_NPROBE = 16
+IVFPQ_M = 64
+IVFPQ_NBITS = 8
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 128
+
+# pHash/wHash index type: "binary" (linear Hamming scan) or "binary_mih" (multi-index hashing)
+HASH_INDEX_TYPE = "binary"
+HASH_MIH_NHASH = max(PHASH_THRESHOLD, WHASH_THRESHOLD) + 1
+
+SEARCH_THREADS = min(16, os.cpu_count() or 1)
+
+# Map frozen shards read-only (all types with faiss IO_FLAG_MMAP_IFC, IVF only without it)
+INDEX_MMAP = True
+INDEX_LOAD_WORKERS = min(8, os.cpu_count() or 1)
+
+# "index": store 7 augmented hashes per image; "query": store 1 and search the query's 7 variants
+HASH_AUGMENT_MODE = "index"
+
+# CLIP/DINO inference: "torch" (eager fp32), "torchscript", "int8" (dynamic, CPU) or "onnx" (needs onnxruntime)
+INFERENCE_BACKEND = "torch"
+BACKEND_COSINE_TOLERANCE = 0.99
+BACKEND_VALIDATION_SAMPLES = 4
+# Exported backends are compared with fp32 on these images (Gaussian noise if there are none)
+BACKEND_VALIDATION_DIR = PROJECT_ROOT / "assets" / "examples"
+
+# Compressed dense types: "sq8" (8-bit scalar), "pq" (product quantized), "fp16"
+PQ_M = 96
+PQ_NBITS = 8
+# Keep full-precision vectors on disk for non-flat dense indices and re-rank the top candidates exactly
+DENSE_RERANK = True
+RERANK_DEPTH = 32
+
+# Target dims for `migrate_indices.py --pca` (128 or 256); thresholds stay in 768-d cosine units
+PCA_DIM = 256
+PCA_WHITEN = False
+
+# Hamming prefilter for dense search: None, "sign" (1 bit per dim) or "itq" (PREFILTER_BITS-bit ITQ codes).
+# The top PREFILTER_DEPTH codes are re-scored exactly from the on-disk vector store.
+DENSE_PREFILTER = None
+PREFILTER_BITS = 256
+PREFILTER_DEPTH = 256
+
+# Content-addressed feature cache (hashes, ORB counts, CLIP/DINO embeddings) under CACHE_DIR
+CACHE_ENABLED = True
+CACHE_MAX_MB = 2048
+CACHE_SEGMENT_MB = 64
+
+# Async detection service (web/service.py)
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8000
+BATCH_MAX_SIZE = 16
+BATCH_MAX_WAIT_MS = 10
+JOB_HISTORY = 10000
+
+# Images per stage batch in pipeline.check_images_pipeline
+PIPELINE_CHUNK_SIZE = 256
+
+# check_image_pipeline latency mode: run DINO (and CLIP for the ambiguous band) on a worker
+# alongside the ORB/hash stages and discard it when the hashes decide. Trades idle cores for latency.
+SPECULATIVE_PIPELINE = False
+SPECULATIVE_WORKERS = 2
+
+# Write-ahead log for online adds (pipeline.add_to_indices), replayed when an index is loaded.
+# Concurrent adds share one fsync per WAL_GROUP_COMMIT_MS window; the background checkpointer
+# saves changed active shards every WAL_CHECKPOINT_SECONDS or after WAL_CHECKPOINT_MB of log.
+WAL_ENABLED = True
+WAL_FSYNC = True
+WAL_GROUP_COMMIT_MS = 2
+WAL_SEGMENT_MB = 64
+WAL_CHECKPOINT_SECONDS = 60
+WAL_CHECKPOINT_MB = 256
+
+# Ambiguous DINO band: re-rank the top VERIFY_TOP_K DINO candidates with the hist_match score
+# (ORB + gray/HSV histograms stored at ingest); a candidate at HIST_THRESHOLD or above is a match.
+VERIFY_ENABLED = True
+VERIFY_TOP_K = 5
+
+# Ambiguous DINO band: CLIP scores only the top CLIP_CANDIDATE_K DINO candidates (by id, no corpus scan)
+# and ranks them by FUSION_WEIGHT * clip + (1 - FUSION_WEIGHT) * dino. 0 restores the full CLIP search.
+CLIP_CANDIDATE_K = 10
+FUSION_WEIGHT = 0.5
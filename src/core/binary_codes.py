@@ -0,0 +1,52 @@
+import os
+
+import faiss
+import numpy as np
+
+PREFILTER_MODES = ("sign", "itq")
+
+
+class BinaryEncoder:
+    """
+    Packs float embeddings into binary codes for the Hamming prefilter.
+    "sign": one bit per dimension (x > 0), no training.
+    "itq": PCA to nbits dimensions plus a learned rotation (iterative
+    quantization) before the sign, trained once on a sample of the index.
+    """
+
+    def __init__(self, mode, dimension, nbits=None, path=None):
+        self.mode = mode
+        self.dimension = dimension
+        self.path = path
+        self.transform = None
+        self.nbits = nbits if mode == "itq" else dimension
+
+        if mode == "itq" and path and os.path.exists(path):
+            self.transform = faiss.downcast_VectorTransform(faiss.read_VectorTransform(path))
+            print(f"Loaded ITQ transform: {path}")
+
+    @property
+    def is_trained(self):
+        return self.mode == "sign" or self.transform is not None
+
+    def train(self, sample):
+        if self.mode != "itq":
+            return
+        sample = np.ascontiguousarray(sample, dtype=np.float32)
+        print(f"Training ITQ {self.dimension} -> {self.nbits} bits on {len(sample)} vectors...")
+        transform = faiss.ITQTransform(self.dimension, self.nbits, True)
+        transform.train(sample)
+        self.transform = transform
+        if self.path:
+            faiss.write_VectorTransform(transform, self.path)
+
+    def encode(self, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.transform is not None:
+            vectors = self.transform.apply(vectors)
+        return np.packbits(vectors > 0, axis=1)
+
+    def reset(self):
+        self.transform = None
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,307 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from src import config
+from src.utils import hasher as fph
+from src.utils.digest import bytes_digest
+from src.core.feature_cache import get_feature_cache
+from src.core.index_manager import remove_image_rows
+from src.models.preprocessing import INPUT_SIZE, resize_image
+from src.utils.decoding import open_image
+from src.utils.image_context import DECODE_SIZE
+from src.utils.verification import extract_features, preprocess_image
+
+VALID_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tiff'}
+
+_DONE = object()
+
+
+def scan_images(root, skip_dirs=()):
+    stack = [str(root)]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in skip_dirs:
+                            stack.append(entry.path)
+                    elif os.path.splitext(entry.name)[1].lower() in VALID_EXTENSIONS:
+                        yield entry.path.replace('\\', '/')
+        except OSError as e:
+            print(f"Cannot scan {current}: {e}")
+
+
+def prepare_image(image_path):
+    # Runs in a worker process: decode once, hash every augmentation and
+    # downscale to the model input size so only small arrays cross the process boundary.
+    # Hashes come from the HASH_DECODE_SIZE decode, which is the same one for small files.
+    item = {"path": image_path, "phash": None, "whash": None, "pixels": None, "features": None, "error": None,
+            "size": None, "mtime_ns": None, "digest": None, "dims": (None, None)}
+    try:
+        with open(image_path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            data = f.read()
+        item.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns, digest=bytes_digest(data))
+
+        img, item["dims"] = open_image(data, DECODE_SIZE if config.VERIFY_ENABLED else (INPUT_SIZE, INPUT_SIZE))
+        with img:
+            img.load()
+            try:
+                item["phash"], item["whash"] = fph.get_index_hash_vectors(fph.open_for_hashing(data, img),
+                                                                          config.HASH_AUGMENT_MODE)
+            except Exception as e:
+                item["error"] = f"hashing failed: {e}"
+
+            rgb = img.convert("RGB")
+            item["pixels"] = resize_image(rgb)
+            if config.VERIFY_ENABLED:
+                bgr = np.ascontiguousarray(np.asarray(rgb)[:, :, ::-1])
+                item["features"] = extract_features(preprocess_image(bgr))
+    except Exception as e:
+        item["error"] = str(e)
+    return item
+
+
+class BulkIndexer:
+    """
+    Streaming folder indexer.
+    scan thread -> bounded path queue -> process pool (decode + hashes)
+    -> batched CLIP/DINO on the model thread -> IndexShardManager.add.
+    At most queue_size images are in flight between the scanner and the
+    model thread; the slowest stage throttles everything in front of it.
+    """
+
+    def __init__(self, managers, catalog, manifest=None, workers=None, batch_size=None, queue_size=None,
+                 checkpoint_every=None, report_seconds=None, persist=None, verification_store=None):
+        self.managers = managers
+        self.persist = persist
+        self.verification_store = verification_store
+        self.catalog = catalog
+        self.manifest = manifest
+        self.workers = workers or config.INDEX_WORKERS
+        self.batch_size = batch_size or config.EMBED_BATCH_SIZE
+        self.queue_size = queue_size or config.INDEX_QUEUE_SIZE
+        self.checkpoint_every = checkpoint_every or config.INDEX_CHECKPOINT_EVERY
+        self.report_seconds = report_seconds or config.INDEX_REPORT_SECONDS
+
+        self.path_queue = queue.Queue(maxsize=self.queue_size)
+        self.ready_queue = queue.Queue()
+        self.inflight = threading.Semaphore(self.queue_size)
+        self.stop_event = threading.Event()
+
+        self.indexed_paths = []
+        self.failed = 0
+        self.error = None
+        self.skipped = 0
+        self.since_checkpoint = 0
+        self.started_at = None
+        self.last_report = None
+
+    def _produce(self, image_dir, skip_dirs):
+        try:
+            for image_path in scan_images(image_dir, skip_dirs):
+                if self.stop_event.is_set():
+                    break
+                if self.manifest is not None and not self.manifest.needs_indexing(image_path):
+                    self.skipped += 1
+                    continue
+                self.path_queue.put(image_path)
+        finally:
+            self.path_queue.put(_DONE)
+
+    def _on_prepared(self, image_path, future):
+        try:
+            item = future.result()
+        except Exception as e:
+            item = {"path": image_path, "phash": None, "whash": None, "pixels": None, "error": str(e),
+                    "size": None, "mtime_ns": None, "digest": None, "dims": (None, None)}
+        self.ready_queue.put(item)
+
+    def _next_batch(self):
+        batch = []
+        finished = False
+        item = self.ready_queue.get()
+        while True:
+            if item is _DONE:
+                finished = True
+                break
+            batch.append(item)
+            self.inflight.release()
+            if len(batch) >= self.batch_size:
+                break
+            try:
+                item = self.ready_queue.get(timeout=0.05)
+            except queue.Empty:
+                break
+        return batch, finished
+
+    def _index_batch(self, batch):
+        from src.models import clip_engine as ct
+        from src.models import dino_engine as dt
+
+        for item in batch:
+            if item["error"]:
+                print(f"Error preparing {item['path']}: {item['error']}")
+
+        # An image counts as indexed only once it is in all four indices; one
+        # that cannot be hashed or decoded is not added anywhere.
+        complete = [item for item in batch if item["phash"] is not None and item["pixels"] is not None]
+        indexed = set()
+        if complete:
+            paths = [item["path"] for item in complete]
+            # A path the catalog already has is being re-indexed (changed content,
+            # or --force): its old rows go before it is added back under its id.
+            stale = [image_id for image_id in self.catalog.get_ids(paths) if image_id is not None]
+            if stale:
+                self.remove_ids(stale)
+            ids = self.catalog.add_many(paths, [item["dims"] for item in complete])
+
+            try:
+                images = [item["pixels"] for item in complete]
+                clip_embs = self._embed(complete, images, "clip", ct.model_version(),
+                                        lambda imgs: ct.embed_clip_pixels(ct.preprocess(imgs), self.batch_size))
+                dino_embs = self._embed(complete, images, "dino", dt.model_version(),
+                                        lambda imgs: dt.embed_dino_pixels(dt.preprocess(imgs), self.batch_size))
+                for item, image_id in zip(complete, ids):
+                    self.managers["phash"].add(item["phash"], image_id)
+                    self.managers["whash"].add(item["whash"], image_id)
+                self.managers["clip"].add(clip_embs, ids)
+                self.managers["dino"].add(dino_embs, ids)
+                if self.verification_store is not None:
+                    self.verification_store.put_many([(image_id, item["features"]) for item, image_id in zip(complete, ids)
+                                                      if item["features"] is not None])
+                indexed.update(paths)
+            except Exception as e:
+                # Drop whatever part of the batch made it in, so no image is left
+                # in the hash indices without its CLIP/DINO rows.
+                print(f"Error indexing batch of {len(paths)}, rolling it back: {e}")
+                self.remove_ids(ids)
+
+        for item in batch:
+            if item["path"] in indexed:
+                self.indexed_paths.append(item["path"])
+                if self.manifest is not None:
+                    self.manifest.record(item["path"], item["size"], item["mtime_ns"], item["digest"])
+            else:
+                self.failed += 1
+                print(f"Failed to index: {item['path']}")
+
+        self.since_checkpoint += len(batch)
+
+    def remove_ids(self, image_ids):
+        remove_image_rows(self.managers.values(), image_ids, self.verification_store)
+
+    def _embed(self, items, images, kind, version, embed):
+        # Embeddings cached under the file digest are reused; only misses reach the model.
+        cache = get_feature_cache()
+        rows = [cache.get(item["digest"], kind, version) if cache is not None else None for item in items]
+        missing = [i for i, row in enumerate(rows) if row is None]
+        if missing:
+            computed = embed([images[i] for i in missing])
+            for i, emb in zip(missing, computed):
+                rows[i] = emb.reshape(1, -1)
+                if cache is not None:
+                    cache.put(items[i]["digest"], kind, rows[i], version)
+        return np.vstack(rows)
+
+    def _report(self, force=False):
+        now = time.time()
+        if not force and now - self.last_report < self.report_seconds:
+            return
+        self.last_report = now
+        elapsed = max(now - self.started_at, 1e-6)
+        done = len(self.indexed_paths) + self.failed
+        print(f"Indexed {len(self.indexed_paths)} images, {self.failed} failed, {self.skipped} unchanged "
+              f"({done / elapsed:.1f} img/s, {self.ready_queue.qsize()} ready, {self.path_queue.qsize()} queued)")
+
+    def checkpoint(self):
+        print(f"Checkpoint after {len(self.indexed_paths)} images...")
+        if self.persist is not None:
+            self.persist()
+        else:
+            for manager in self.managers.values():
+                manager.persist()
+        if self.manifest is not None:
+            self.manifest.commit()
+        self.since_checkpoint = 0
+
+    def _consume(self):
+        # Never exits before _DONE: the main loop blocks on capacity that only
+        # this thread releases. A failed batch is counted and skipped; a failed
+        # checkpoint stops the run and the rest of the queue is drained unindexed.
+        while True:
+            batch, finished = self._next_batch()
+            if batch and self.error is None:
+                try:
+                    self._index_batch(batch)
+                except Exception as e:
+                    print(f"Error indexing batch of {len(batch)}: {e}")
+                    self.failed += len(batch)
+                self._report()
+                if self.since_checkpoint >= self.checkpoint_every:
+                    try:
+                        self.checkpoint()
+                    except Exception as e:
+                        print(f"Checkpoint failed, stopping: {e}")
+                        self.error = e
+                        self.stop_event.set()
+            if finished:
+                break
+
+    def run(self, image_dir, skip_dirs=()):
+        self.started_at = time.time()
+        self.last_report = self.started_at
+
+        producer = threading.Thread(target=self._produce, args=(image_dir, skip_dirs), daemon=True)
+        consumer = threading.Thread(target=self._consume, daemon=True)
+        producer.start()
+        consumer.start()
+
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                while True:
+                    image_path = self.path_queue.get()
+                    if image_path is _DONE:
+                        break
+                    self.inflight.acquire()
+                    future = pool.submit(prepare_image, image_path)
+                    future.add_done_callback(partial(self._on_prepared, image_path))
+        except KeyboardInterrupt:
+            print("\nInterrupted, finishing images already in flight...")
+            self.stop_event.set()
+        finally:
+            self.ready_queue.put(_DONE)
+            consumer.join()
+
+        if self.error is not None:
+            raise RuntimeError(f"Indexing stopped after a failed checkpoint: {self.error}") from self.error
+        if self.indexed_paths or self.since_checkpoint:
+            self.checkpoint()
+        elif self.manifest is not None:
+            self.manifest.commit()
+        self._report(force=True)
+        return self.indexed_paths
+
+
+def index_folder(image_dir, skip_dirs=(), incremental=True, **options):
+    import src.core.pipeline as duplicate_checker
+    from src.core.manifest import IndexManifest
+
+    managers = {name: duplicate_checker.get_manager(name) for name in ("phash", "whash", "clip", "dino")}
+    manifest = IndexManifest() if incremental else None
+    # Checkpoints go through the pipeline so the WAL learns what the shards now hold.
+    options.setdefault("persist", duplicate_checker.persist_indices)
+    options.setdefault("verification_store", duplicate_checker.get_verification_store())
+    indexer = BulkIndexer(managers, duplicate_checker.get_catalog(), manifest=manifest, **options)
+    try:
+        return indexer.run(image_dir, skip_dirs)
+    finally:
+        if manifest is not None:
+            manifest.close()
@@ -0,0 +1,101 @@
+import os
+import sqlite3
+import threading
+import time
+
+from src import config
+
+
+def resolve_path(path_entry):
+    path_entry = str(path_entry).replace("\\", "/")
+
+    if os.path.exists(path_entry):
+        return os.path.abspath(path_entry)
+
+    candidate_images = config.IMAGE_DIR / os.path.basename(path_entry)
+    if candidate_images.exists():
+        return str(candidate_images.resolve())
+
+    if "/DejaView/" in path_entry:
+        relative_part = path_entry.split("/DejaView/", 1)[1]
+        candidate = config.PROJECT_ROOT / relative_part
+        if candidate.exists():
+            return str(candidate.resolve())
+
+    return os.path.abspath(path_entry)
+
+
+class ImageCatalog:
+    """
+    Single id -> path table shared by the pHash, wHash, CLIP and DINO indices.
+    Shards store catalog ids through faiss IDMaps, so a hit resolves to its
+    path with one primary-key lookup and no filesystem access.
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = str(db_path or config.INDEX_DIR / "catalog.sqlite")
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT UNIQUE NOT NULL, "
+            "width INTEGER, height INTEGER, added_at REAL)"
+        )
+        self.conn.commit()
+        self.lock = threading.Lock()
+        print(f"Loaded image catalog: {len(self)} images")
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def add(self, path, width=None, height=None):
+        return self.add_many([path], [(width, height)])[0]
+
+    def add_many(self, paths, sizes=None):
+        paths = [os.path.abspath(str(p)).replace("\\", "/") for p in paths]
+        sizes = sizes or [(None, None)] * len(paths)
+        now = time.time()
+
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO images (path, width, height, added_at) VALUES (?, ?, ?, ?)",
+                [(path, width, height, now) for path, (width, height) in zip(paths, sizes)]
+            )
+            ids = {}
+            for path in paths:
+                if path not in ids:
+                    ids[path] = self.conn.execute("SELECT id FROM images WHERE path = ?", (path,)).fetchone()[0]
+        return [ids[path] for path in paths]
+
+    def get_id(self, path):
+        path = os.path.abspath(str(path)).replace("\\", "/")
+        with self.lock:
+            row = self.conn.execute("SELECT id FROM images WHERE path = ?", (path,)).fetchone()
+        return row[0] if row else None
+
+    def get_ids(self, paths):
+        # Id of each path, or None where the catalog does not have it.
+        paths = [os.path.abspath(str(p)).replace("\\", "/") for p in paths]
+        with self.lock:
+            return [
+                (self.conn.execute("SELECT id FROM images WHERE path = ?", (path,)).fetchone() or (None,))[0]
+                for path in paths
+            ]
+
+    def get_path(self, image_id):
+        with self.lock:
+            row = self.conn.execute("SELECT path FROM images WHERE id = ?", (int(image_id),)).fetchone()
+        return row[0] if row else None
+
+    def get_record(self, image_id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT id, path, width, height, added_at FROM images WHERE id = ?", (int(image_id),)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("id", "path", "width", "height", "added_at"), row))
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,137 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from src import config
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_feature_cache():
+    global _cache
+    if not config.CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = FeatureCache()
+    return _cache
+
+
+class FeatureCache:
+    """
+    Content-addressed store for per-image features (hashes, ORB counts,
+    CLIP/DINO embeddings), keyed by the blake2b digest of the file bytes and
+    a feature/version tag. Arrays are appended raw to segment files; an
+    SQLite table maps each key to (segment, offset, length, dtype, shape)
+    and its last use. Past max_bytes the least recently used entries are
+    dropped and fully dead segments deleted.
+    """
+
+    def __init__(self, root=None, max_bytes=None, segment_bytes=None):
+        self.root = str(root or config.CACHE_DIR)
+        self.max_bytes = max_bytes or config.CACHE_MAX_MB * 1024 * 1024
+        self.segment_bytes = segment_bytes or config.CACHE_SEGMENT_MB * 1024 * 1024
+        os.makedirs(self.root, exist_ok=True)
+
+        self.conn = sqlite3.connect(os.path.join(self.root, "cache.sqlite"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, segment INTEGER, offset INTEGER, length INTEGER, "
+            "dtype TEXT, shape TEXT, last_used REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self.conn.commit()
+        self.lock = threading.Lock()
+
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(length), 0) FROM entries").fetchone()[0]
+        segments = [int(name.split("_")[1].split(".")[0]) for name in os.listdir(self.root) if name.startswith("segment_")]
+        self.segment_id = max(segments, default=0)
+
+    def segment_path(self, segment_id):
+        return os.path.join(self.root, f"segment_{segment_id:06d}.bin")
+
+    @staticmethod
+    def make_key(digest, kind, version):
+        return f"{digest}:{kind}:{version}"
+
+    def get(self, digest, kind, version=""):
+        key = self.make_key(digest, kind, version)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT segment, offset, length, dtype, shape FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            segment, offset, length, dtype, shape = row
+            try:
+                with open(self.segment_path(segment), "rb") as f:
+                    f.seek(offset)
+                    data = f.read(length)
+            except OSError:
+                data = b""
+            if len(data) != length:
+                self._delete([key], length)
+                return None
+            with self.conn:
+                self.conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        return np.frombuffer(data, dtype=dtype).reshape(json.loads(shape)).copy()
+
+    def put(self, digest, kind, array, version=""):
+        key = self.make_key(digest, kind, version)
+        array = np.ascontiguousarray(array)
+        data = array.tobytes()
+        with self.lock:
+            path = self.segment_path(self.segment_id)
+            if os.path.exists(path) and os.path.getsize(path) + len(data) > self.segment_bytes:
+                self.segment_id += 1
+                path = self.segment_path(self.segment_id)
+            with open(path, "ab") as f:
+                offset = f.tell()
+                f.write(data)
+
+            old = self.conn.execute("SELECT length FROM entries WHERE key = ?", (key,)).fetchone()
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, segment, offset, length, dtype, shape, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, self.segment_id, offset, len(data), array.dtype.str, json.dumps(array.shape), time.time())
+                )
+            self.total_bytes += len(data) - (old[0] if old else 0)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _delete(self, keys, freed):
+        with self.conn:
+            self.conn.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in keys])
+        self.total_bytes -= freed
+
+    def _evict(self):
+        # Drop least recently used entries down to 90% of the budget, then
+        # delete segments no live entry points into.
+        target = self.total_bytes - int(self.max_bytes * 0.9)
+        keys, freed = [], 0
+        for key, length in self.conn.execute("SELECT key, length FROM entries ORDER BY last_used"):
+            if freed >= target:
+                break
+            keys.append(key)
+            freed += length
+        self._delete(keys, freed)
+
+        live = {row[0] for row in self.conn.execute("SELECT DISTINCT segment FROM entries")}
+        for name in os.listdir(self.root):
+            if not name.startswith("segment_"):
+                continue
+            segment = int(name.split("_")[1].split(".")[0])
+            if segment != self.segment_id and segment not in live:
+                os.remove(os.path.join(self.root, name))
+        print(f"Feature cache evicted {len(keys)} entries ({freed / 1024 / 1024:.1f} MB)")
+
+    def close(self):
+        self.conn.close()
@@ -1,29 +1,97 @@
 import os
 import src.utils.faiss_ops as fi
 import numpy as np
-import heapq
 import glob
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src import config
+from src.core.catalog import resolve_path
+from src.core.vector_store import VectorStore
+from src.core.binary_codes import BinaryEncoder
+from src.core.wal import encode_record, read_segment, repair_segment
+
+_search_pool = None
+_search_pool_lock = threading.Lock()
+
+
+def get_search_pool():
+    # faiss releases the GIL while searching, so shards of one query run in parallel.
+    global _search_pool
+    with _search_pool_lock:
+        if _search_pool is None:
+            _search_pool = ThreadPoolExecutor(max_workers=config.SEARCH_THREADS, thread_name_prefix="shard-search")
+    return _search_pool
+
+
+def select_top_k(D, I, key, k):
+    # Row-wise k smallest keys, best first.
+    top_k = min(k, D.shape[1])
+    if D.shape[1] > top_k:
+        part = np.argpartition(key, top_k - 1, axis=1)[:, :top_k]
+        D = np.take_along_axis(D, part, axis=1)
+        I = np.take_along_axis(I, part, axis=1)
+        key = np.take_along_axis(key, part, axis=1)
+    
+    order = np.argsort(key, axis=1, kind="stable")
+    return np.take_along_axis(D, order, axis=1), np.take_along_axis(I, order, axis=1)
+
+
+def remove_image_rows(managers, image_ids, verification_store=None):
+    # Every row of the given ids, in each index and the verification store;
+    # done before a changed file is added back under its existing id.
+    for manager in managers:
+        manager.remove_ids(image_ids)
+    if verification_store is not None:
+        verification_store.delete_many(image_ids)
 
 
 class IndexShardManager:
-    def __init__(self, base_dir, prefix, dimension, index_type="flat", max_vectors=1000000):
+    def __init__(self, base_dir, prefix, dimension, index_type="flat", max_vectors=1000000,
+                 nprobe=None, ef_search=None, train_size=None, catalog=None, rerank=None, prefilter=None):
         self.base_dir = base_dir
         self.prefix = prefix
         self.dimension = dimension
         self.index_type = index_type
+        self.is_binary = index_type.startswith("binary")
         self.max_vectors = max_vectors
+        self.nprobe = nprobe or config.IVF_NPROBE
+        self.ef_search = ef_search or config.HNSW_EF_SEARCH
+        self.train_size = train_size or config.ANN_TRAIN_SIZE
+        self.catalog = catalog
         
         self.indices = []
         self.active_index = None
         self.active_suffix_id = 0
-        self.paths = []
+        self.trained_template = None
+        self.vector_store = None
+        self.encoder = None
+        self.code_indices = {}
+        self.dirty = False
+        # Rows added to (or, with vectors None, removed from) the active shard
+        # since its file or delta was last written.
+        self.unsaved = []
+        self.delta_lock = threading.Lock()
         
         if not os.path.exists(self.base_dir):
             os.makedirs(self.base_dir)
             print(f"Created directory: {self.base_dir}")
         
+        rerank = config.DENSE_RERANK if rerank is None else rerank
+        prefilter = config.DENSE_PREFILTER if prefilter is None else prefilter
+        if prefilter and not self.is_binary:
+            self.encoder = BinaryEncoder(prefilter, self.dimension, config.PREFILTER_BITS, self.get_itq_filename())
+        if not self.is_binary and ((rerank and self.index_type != "flat") or self.encoder is not None):
+            # Compressed/ANN scores are approximate and prefilter hits are re-scored by id;
+            # keep exact vectors on disk for both.
+            self.vector_store = VectorStore(self.get_vectors_filename(), self.dimension)
+        
+        self.load_trained_template()
         self.load_indices()
-        self.load_paths()
+        self.migrate_legacy_shards()
+        self.maybe_train()
+        self.maybe_train_codes()
+        self.load_codes()
         
         print(f"Initialized {self.prefix}: {self.get_total_vectors()} total vectors across {len(self.indices)} shards")
     
@@ -33,11 +101,222 @@ class IndexShardManager:
     def get_paths_filename(self):
         return os.path.join(self.base_dir, f"{self.prefix}_paths.npy")
 
+    def get_vectors_filename(self):
+        return os.path.join(self.base_dir, f"{self.prefix}_vectors.f32")
+
+    def get_delta_filename(self, suffix_id):
+        return os.path.join(self.base_dir, f"{self.prefix}_{suffix_id}.delta")
+
+    def get_codes_filename(self, suffix_id):
+        return os.path.join(self.base_dir, f"{self.prefix}_{suffix_id}.codes")
+
+    def get_itq_filename(self):
+        return os.path.join(self.base_dir, f"{self.prefix}_itq.vt")
+
+    def get_trained_filename(self):
+        return os.path.join(self.base_dir, f"{self.prefix}_trained.index")
+
     def create_new_index(self):
-        if self.index_type == "binary":
+        # Every shard maps its rows to image ids from the shared ImageCatalog.
+        return fi.wrap_with_ids(self.create_base_index())
+
+    def create_base_index(self):
+        if self.index_type == "binary_mih":
+            return fi.create_binary_multihash_index(self.dimension, config.HASH_MIH_NHASH)
+        if self.is_binary:
             return fi.create_binary_index(self.dimension)
-        else:
-            return fi.create_flat_ip_index(self.dimension)
+        if self.index_type == "hnsw":
+            return fi.create_hnsw_index(self.dimension, config.HNSW_M, config.HNSW_EF_CONSTRUCTION)
+        if self.index_type == "fp16":
+            return fi.create_fp16_index(self.dimension)
+        if self.index_type in fi.TRAINED_INDEX_TYPES and self.trained_template is not None:
+            return fi.clone_index(self.trained_template)
+        # "flat", or a trained type (IVF/SQ8/PQ) that has not been trained yet: vectors are staged
+        # in an exact shard and moved into the trained index by maybe_train().
+        return fi.create_flat_ip_index(self.dimension)
+
+    def create_trainable_index(self):
+        if self.index_type == "ivf":
+            return fi.create_ivf_index(self.dimension, config.IVF_NLIST)
+        if self.index_type == "sq8":
+            return fi.create_sq8_index(self.dimension)
+        if self.index_type == "pq":
+            return fi.create_pq_index(self.dimension, self.pq_m(config.PQ_M), config.PQ_NBITS)
+        return fi.create_ivfpq_index(self.dimension, config.IVF_NLIST, self.pq_m(config.IVFPQ_M), config.IVFPQ_NBITS)
+
+    def pq_m(self, m):
+        fitted = fi.fit_pq_m(self.dimension, m)
+        if fitted != m:
+            print(f"{self.prefix}: {m} PQ sub-quantizers do not divide {self.dimension} dims, using {fitted}")
+        return fitted
+
+    def load_trained_template(self):
+        filename = self.get_trained_filename()
+        if self.index_type in fi.TRAINED_INDEX_TYPES and os.path.exists(filename):
+            self.trained_template = fi.read_index(filename, is_binary=False)
+            print(f"Loaded trained {self.index_type} template for {self.prefix}")
+
+    def train(self, sample):
+        if self.index_type not in fi.TRAINED_INDEX_TYPES:
+            print(f"{self.prefix}: index type {self.index_type} needs no training")
+            return
+
+        sample = np.ascontiguousarray(sample, dtype=np.float32)
+        template = self.create_trainable_index()
+        print(f"Training {self.prefix} {self.index_type} index on {len(sample)} vectors...")
+        template.train(sample)
+
+        self.trained_template = template
+        fi.write_index(template, self.get_trained_filename(), is_binary=False)
+        print(f"Saved trained template: {self.get_trained_filename()}")
+
+    def maybe_train(self):
+        if self.index_type not in fi.TRAINED_INDEX_TYPES or not fi.is_flat_index(self.active_index):
+            return
+
+        if self.trained_template is None:
+            if self.active_index.ntotal < self.train_size:
+                return
+            self.train(fi.sample_vectors(self.active_index, self.train_size))
+
+        self.active_index = self.rebuild_index(self.active_index)
+        self.indices[-1] = (self.active_index, self.active_suffix_id)
+
+    def rebuild_index(self, index):
+        new_index = self.create_new_index()
+        if index.ntotal > 0:
+            dtype = np.uint8 if self.is_binary else np.float32
+            vectors = np.ascontiguousarray(fi.reconstruct_all(index), dtype=dtype)
+            ids = fi.get_ids(index)
+            if self.vector_store is not None and fi.stores_full_vectors(index):
+                self.vector_store.put(ids, vectors)
+            new_index.add_with_ids(vectors, ids)
+        return new_index
+
+    def sample(self, n):
+        # Up to n stored vectors, drawn from every shard in proportion to its size.
+        total = self.get_total_vectors()
+        samples = []
+        for idx_obj, _ in self.indices:
+            if idx_obj.ntotal > 0:
+                share = max(1, int(n * idx_obj.ntotal / total))
+                samples.append(fi.sample_vectors(idx_obj, share))
+        return np.vstack(samples) if samples else None
+
+    def rebuild_shards(self):
+        if self.index_type in fi.TRAINED_INDEX_TYPES and self.trained_template is None:
+            sample = self.sample(self.train_size)
+            if sample is None:
+                print(f"{self.prefix}: no vectors to train on")
+                return
+            self.train(sample)
+
+        for position, (idx_obj, suffix_id) in enumerate(self.indices):
+            print(f"Rebuilding shard {self.prefix}_{suffix_id} ({idx_obj.ntotal} vectors) as {self.index_type}")
+            new_index = self.rebuild_index(idx_obj)
+            self.indices[position] = (new_index, suffix_id)
+            fi.write_index(new_index, self.get_index_filename(suffix_id), is_binary=self.is_binary)
+
+        self.active_index = self.indices[-1][0]
+
+    def project_shards(self, projection):
+        """
+        Rewrites every shard, and the full-precision store, in the projection's
+        output space. A trained template belongs to the old space and is dropped;
+        trained types are staged flat until rebuild_shards() retrains them.
+        """
+        old_store = self.vector_store
+        new_store = None
+        if old_store is not None:
+            new_store = VectorStore(self.get_vectors_filename() + ".projected", projection.d_out)
+
+        self.dimension = projection.d_out
+        self.trained_template = None
+        if os.path.exists(self.get_trained_filename()):
+            os.remove(self.get_trained_filename())
+
+        for position, (idx_obj, suffix_id) in enumerate(self.indices):
+            print(f"Projecting shard {self.prefix}_{suffix_id} ({idx_obj.ntotal} vectors) to {projection.d_out} dims")
+            new_index = self.create_new_index()
+            if idx_obj.ntotal > 0:
+                vectors = np.ascontiguousarray(fi.reconstruct_all(idx_obj), dtype=np.float32)
+                ids = fi.get_ids(idx_obj)
+                if old_store is not None:
+                    stored = old_store.get(ids)
+                    known = np.any(stored != 0, axis=1)
+                    vectors[known] = stored[known]
+                projected = projection.apply(vectors)
+                new_index.add_with_ids(projected, ids)
+                if new_store is not None:
+                    new_store.put(ids, projected)
+            self.indices[position] = (new_index, suffix_id)
+            fi.write_index(new_index, self.get_index_filename(suffix_id), is_binary=False)
+
+        self.active_index = self.indices[-1][0]
+        if new_store is not None:
+            new_store.flush()
+            old_store.data = None
+            new_store.data = None
+            os.replace(new_store.path, self.get_vectors_filename())
+            self.vector_store = VectorStore(self.get_vectors_filename(), self.dimension)
+        self.reset_codes()
+
+    def create_code_index(self):
+        return fi.wrap_with_ids(fi.create_binary_index(self.encoder.nbits))
+
+    def build_codes(self, idx_obj):
+        code_index = self.create_code_index()
+        if idx_obj.ntotal > 0:
+            vectors = np.ascontiguousarray(fi.reconstruct_all(idx_obj), dtype=np.float32)
+            ids = fi.get_ids(idx_obj)
+            stored = self.vector_store.get(ids)
+            known = np.any(stored != 0, axis=1)
+            if fi.stores_full_vectors(idx_obj):
+                self.vector_store.put(ids[~known], vectors[~known])
+            else:
+                vectors[known] = stored[known]
+            code_index.add_with_ids(self.encoder.encode(vectors), ids)
+        return code_index
+
+    def load_codes(self):
+        # One binary code shard per vector shard; missing or stale ones are rebuilt.
+        if self.encoder is None or not self.encoder.is_trained:
+            return
+        for idx_obj, suffix_id in self.indices:
+            if suffix_id in self.code_indices:
+                continue
+            filename = self.get_codes_filename(suffix_id)
+            code_index = None
+            if os.path.exists(filename):
+                code_index = fi.read_index(filename, is_binary=True)
+                if code_index.ntotal != idx_obj.ntotal or code_index.d != self.encoder.nbits:
+                    code_index = None
+            if code_index is None:
+                print(f"Building {self.encoder.mode} codes for {self.prefix}_{suffix_id}")
+                code_index = self.build_codes(idx_obj)
+                fi.write_index(code_index, filename, is_binary=True)
+            self.code_indices[suffix_id] = code_index
+
+    def maybe_train_codes(self):
+        if self.encoder is None or self.encoder.is_trained or self.get_total_vectors() < self.train_size:
+            return
+        self.encoder.train(self.sample(self.train_size))
+        self.load_codes()
+
+    def reset_codes(self):
+        if self.encoder is None:
+            return
+        for suffix_id in list(self.code_indices):
+            if os.path.exists(self.get_codes_filename(suffix_id)):
+                os.remove(self.get_codes_filename(suffix_id))
+        self.code_indices = {}
+        self.encoder.reset()
+        self.encoder = BinaryEncoder(self.encoder.mode, self.dimension, config.PREFILTER_BITS, self.get_itq_filename())
+        self.maybe_train_codes()
+        self.load_codes()
+
+    def codes_ready(self):
+        return self.encoder is not None and len(self.code_indices) == len(self.indices)
 
     def load_indices(self):
         pattern = os.path.join(self.base_dir, f"{self.prefix}_*.index")
@@ -53,6 +332,17 @@ class IndexShardManager:
                 valid_files.append((suffix_id, f))
             except (ValueError, IndexError):
                 continue
+
+        # A shard created by rotation may have been checkpointed (as a delta)
+        # before its first full write.
+        known = {suffix_id for suffix_id, _ in valid_files}
+        for f in glob.glob(os.path.join(self.base_dir, f"{self.prefix}_*.delta")):
+            try:
+                suffix_id = int(os.path.splitext(os.path.basename(f))[0].rpartition('_')[2])
+            except (ValueError, IndexError):
+                continue
+            if suffix_id not in known:
+                valid_files.append((suffix_id, None))
     
         valid_files.sort()
     
@@ -64,114 +354,435 @@ class IndexShardManager:
             self.indices.append((self.active_index, 0))
             print(f"Created new shard: {self.prefix}_0")
         else:
-            for suffix_id, filepath in valid_files:
+            last_suffix_id = valid_files[-1][0]
+
+            def load_shard(entry):
+                suffix_id, filepath = entry
+                if filepath is None:
+                    return self.create_new_index()
+                # Only the last shard receives adds; frozen shards are mapped
+                # read-only so worker processes share them through the page cache.
+                frozen = suffix_id != last_suffix_id and not os.path.exists(self.get_delta_filename(suffix_id))
                 print(f"Loading shard: {filepath}")
-                if self.index_type == "binary":
-                    idx = fi.read_index(filepath, is_binary=True)
-                else:
-                    idx = fi.read_index(filepath, is_binary=False)
-                
+                return fi.read_index(filepath, is_binary=self.is_binary, mmap=frozen and config.INDEX_MMAP)
+
+            with ThreadPoolExecutor(max_workers=config.INDEX_LOAD_WORKERS) as pool:
+                loaded = list(pool.map(load_shard, valid_files))
+
+            for (suffix_id, filepath), idx in zip(valid_files, loaded):
                 if idx.d != self.dimension:
                     print(f"Warning: Index {filepath} has dimension {idx.d}, expected {self.dimension}. Skipping/Overwriting.")
                     continue
 
+                mapped = (config.INDEX_MMAP and suffix_id != last_suffix_id and fi.can_mmap(idx)
+                          and not os.path.exists(self.get_delta_filename(suffix_id)))
+                idx = self.apply_delta(idx, suffix_id)
                 self.indices.append((idx, suffix_id))
-                print(f"Loaded shard {suffix_id}: {idx.ntotal} vectors")
+                print(f"Loaded shard {suffix_id}: {idx.ntotal} vectors{' (mmap)' if mapped else ''}")
         
             self.active_suffix_id = valid_files[-1][0]
             self.active_index = self.indices[-1][0]
 
-    def load_paths(self):
+    def apply_delta(self, idx, suffix_id):
+        """
+        Replays what checkpoints appended to <prefix>_<id>.delta, in order:
+        removals, and added rows the shard does not hold yet (a full write
+        after the append already has them). The delta is then folded into the
+        shard file. Returns the shard.
+        """
+        filename = self.get_delta_filename(suffix_id)
+        if not os.path.exists(filename):
+            return idx
+        repair_segment(filename)
+        present = fi.get_ids(idx)
+        applied = 0
+        for _, _, arrays in read_segment(filename):
+            ids = arrays["ids"]
+            if "vectors" not in arrays:
+                idx = self.drop_ids(idx, ids)
+                present = fi.get_ids(idx)
+                continue
+            keep = ~np.isin(ids, present)
+            if keep.any():
+                idx.add_with_ids(np.ascontiguousarray(arrays["vectors"][keep]), ids[keep])
+                applied += int(keep.sum())
+        fi.write_index(idx, self.get_index_filename(suffix_id), is_binary=self.is_binary)
+        os.remove(filename)
+        print(f"Applied {applied} delta rows to {self.prefix}_{suffix_id}")
+        return idx
+
+    def drop_ids(self, idx_obj, ids):
+        # IDMap.remove_ids where the base index supports removal; HNSW and
+        # multi-index hashing do not, so those shards are rebuilt without the rows.
+        # So are IVF shards: their lists keep the old row numbers while the IDMap
+        # compacts its id table, which would shift every later id by one.
+        ids = np.ascontiguousarray(ids, dtype=np.int64)
+        if not fi.is_ann_index(idx_obj):
+            try:
+                idx_obj.remove_ids(fi.make_id_selector(ids))
+                return idx_obj
+            except RuntimeError:
+                pass
+        stored = fi.get_ids(idx_obj)
+        keep = ~np.isin(stored, ids)
+        new_index = self.create_new_index()
+        if keep.any():
+            dtype = np.uint8 if self.is_binary else np.float32
+            vectors = np.ascontiguousarray(fi.reconstruct_all(idx_obj)[keep], dtype=dtype)
+            new_index.add_with_ids(vectors, stored[keep])
+        return new_index
+
+    def remove_ids(self, image_ids):
+        """
+        Drops every row of the given image ids, e.g. before a changed file is
+        indexed again under its id. Frozen shards are rewritten (and mapped
+        again); removals from the active shard are queued with its unsaved
+        rows, so the next checkpoint's delta replays them in order.
+        """
+        ids = np.unique(np.asarray(image_ids, dtype=np.int64))
+        removed = 0
+        for position, (idx_obj, suffix_id) in enumerate(self.indices):
+            count = int(np.isin(fi.get_ids(idx_obj), ids).sum())
+            if not count:
+                continue
+            removed += count
+
+            if suffix_id == self.active_suffix_id:
+                self.active_index = self.drop_ids(idx_obj, ids)
+                self.indices[position] = (self.active_index, suffix_id)
+                self.unsaved.append((ids, None))
+                self.dirty = True
+            else:
+                # Mapped shards are read-only: edit an in-RAM copy and replace the file.
+                filename = self.get_index_filename(suffix_id)
+                writable = self.drop_ids(fi.read_index(filename, is_binary=self.is_binary), ids)
+                fi.write_index(writable, filename, is_binary=self.is_binary)
+                if config.INDEX_MMAP and fi.can_mmap(writable):
+                    writable = fi.read_index(filename, is_binary=self.is_binary, mmap=True)
+                self.indices[position] = (writable, suffix_id)
+
+            if suffix_id in self.code_indices:
+                code_index = self.code_indices[suffix_id]
+                code_index.remove_ids(fi.make_id_selector(ids))
+                if suffix_id != self.active_suffix_id:
+                    fi.write_index(code_index, self.get_codes_filename(suffix_id), is_binary=True)
+
+        if removed and self.vector_store is not None:
+            # All-zero rows read as missing.
+            self.vector_store.put(ids, np.zeros((len(ids), self.dimension), dtype=np.float32))
+        return removed
+
+    def stored_ids(self):
+        # Sorted unique image ids across every shard.
+        return np.unique(np.concatenate([fi.get_ids(idx_obj) for idx_obj, _ in self.indices]))
+
+    def migrate_legacy_shards(self):
+        # Shards written before the catalog existed have no ids; their rows line up
+        # with the pickled <prefix>_paths.npy list across shards in order.
         paths_file = self.get_paths_filename()
+        legacy = [idx_obj for idx_obj, _ in self.indices if not fi.has_ids(idx_obj)]
+        if not legacy and not os.path.exists(paths_file):
+            return
+        if self.catalog is None:
+            print(f"Warning: {self.prefix} has legacy shards without ids; load it with a catalog to migrate")
+            return
+
+        paths = np.load(paths_file, allow_pickle=True).tolist() if os.path.exists(paths_file) else []
+        print(f"Migrating {self.prefix}: {len(paths)} legacy path entries into the image catalog")
+
+        offset = 0
+        for position, (idx_obj, suffix_id) in enumerate(self.indices):
+            ntotal = idx_obj.ntotal
+            if not fi.has_ids(idx_obj):
+                shard_paths = paths[offset:offset + ntotal]
+                new_index = self.create_new_index()
+                if shard_paths:
+                    dtype = np.uint8 if self.is_binary else np.float32
+                    vectors = np.ascontiguousarray(fi.reconstruct_all(idx_obj)[:len(shard_paths)], dtype=dtype)
+                    ids = self.catalog.add_many([resolve_path(p) for p in shard_paths])
+                    new_index.add_with_ids(vectors, np.asarray(ids, dtype=np.int64))
+                if len(shard_paths) < ntotal:
+                    print(f"Warning: dropped {ntotal - len(shard_paths)} vectors of {self.prefix}_{suffix_id} with no path")
+                self.indices[position] = (new_index, suffix_id)
+                fi.write_index(new_index, self.get_index_filename(suffix_id), is_binary=self.is_binary)
+            offset += ntotal
+
+        self.active_index = self.indices[-1][0]
         if os.path.exists(paths_file):
-            self.paths = np.load(paths_file, allow_pickle=True).tolist()
-            print(f"Loaded {self.prefix} paths: {len(self.paths)} entries")
-        else:
-            self.paths = []
-            print(f"No existing {self.prefix} paths found, starting fresh")
+            os.replace(paths_file, paths_file + ".migrated")
+        print(f"Migrated {self.prefix} shards to catalog ids")
 
     def save_active_index(self):
         filename = self.get_index_filename(self.active_suffix_id)
-        if self.index_type == "binary":
+        if self.is_binary:
             fi.write_index(self.active_index, filename, is_binary=True)
         else:
             fi.write_index(self.active_index, filename, is_binary=False)
+        if self.active_suffix_id in self.code_indices:
+            fi.write_index(self.code_indices[self.active_suffix_id], self.get_codes_filename(self.active_suffix_id), is_binary=True)
+        # The full file now holds every row the delta had.
+        self.unsaved = []
+        with self.delta_lock:
+            if os.path.exists(self.get_delta_filename(self.active_suffix_id)):
+                os.remove(self.get_delta_filename(self.active_suffix_id))
         print(f"Saved shard: {filename}")
 
-    def save_paths(self):
-        paths_file = self.get_paths_filename()
-        np.save(paths_file, np.array(self.paths, dtype=object))
-        print(f"Saved paths: {paths_file}")
-
     def persist(self):
         self.save_active_index()
-        self.save_paths()
+        if self.vector_store is not None:
+            self.vector_store.flush()
+        self.dirty = False
         print(f"Persisted {self.prefix} data")
 
+    def snapshot(self):
+        """
+        Takes the rows added since the last checkpoint as (suffix id, [(ids,
+        vectors), ...]); frozen shards were written when they rotated. Only a
+        list is swapped, so the caller's write lock is held for O(1) whatever
+        the shard size. write_snapshot appends them to the shard's delta.
+        """
+        chunks, self.unsaved = self.unsaved, []
+        self.dirty = False
+        return self.active_suffix_id, chunks
+
+    def write_snapshot(self, snapshot):
+        suffix_id, chunks = snapshot
+        filename = self.get_delta_filename(suffix_id)
+        data = b"".join(encode_record(0, -1, {"ids": ids} if vectors is None else {"ids": ids, "vectors": vectors})
+                        for ids, vectors in chunks)
+        with self.delta_lock, open(filename, "ab") as f:
+            start = f.tell()
+            try:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            except OSError:
+                # Never leave a torn record in front of later appends.
+                f.truncate(start)
+                raise
+        if self.vector_store is not None:
+            self.vector_store.flush()
+        print(f"Checkpointed {self.prefix}: {len(chunks)} changes to {os.path.basename(filename)}")
+
+    def restore_snapshot(self, snapshot):
+        # A snapshot that failed to write goes back in front of newer rows,
+        # unless a rotation has already saved its shard in full.
+        suffix_id, chunks = snapshot
+        if suffix_id == self.active_suffix_id:
+            self.unsaved[:0] = chunks
+            self.dirty = True
+
     def rotate_shard(self):
         print(f"Shard {self.active_suffix_id} full ({self.active_index.ntotal} items). Creating new shard.")
         self.save_active_index()
         
+        if config.INDEX_MMAP and fi.can_mmap(self.active_index):
+            # The full shard is frozen from now on: swap the in-RAM copy for a read-only mapping.
+            frozen = fi.read_index(self.get_index_filename(self.active_suffix_id), is_binary=self.is_binary, mmap=True)
+            self.indices[-1] = (frozen, self.active_suffix_id)
+        
         self.active_suffix_id += 1
         self.active_index = self.create_new_index()
         self.indices.append((self.active_index, self.active_suffix_id))
+        if self.encoder is not None and self.encoder.is_trained:
+            self.code_indices[self.active_suffix_id] = self.create_code_index()
         print(f"Created new shard: {self.prefix}_{self.active_suffix_id}")
 
-    def add(self, vector, image_path):
-        if self.active_index.ntotal >= self.max_vectors:
-            self.rotate_shard()
-        
+    def add(self, vector, image_id):
         if len(vector.shape) == 1:
             vector = vector.reshape(1, -1)
         
-        if self.index_type == "binary":
+        if self.is_binary:
             vector = vector.astype(np.uint8)
         else:
             vector = vector.astype(np.float32)
         
-        self.active_index.add(vector)
-        self.paths.append(image_path)
+        if np.ndim(image_id) == 0:
+            ids = np.full(len(vector), int(image_id), dtype=np.int64)
+        else:
+            ids = np.asarray(image_id, dtype=np.int64)
+        
+        if self.vector_store is not None:
+            self.vector_store.put(ids, vector)
+        self.dirty = True
+        
+        if 0 < self.active_index.ntotal and self.active_index.ntotal + len(vector) > self.max_vectors >= len(vector):
+            # An add that fits in one shard is never split across two, so the
+            # rows of one image are always in the same shard file.
+            self.rotate_shard()
+        
+        start = 0
+        while start < len(vector):
+            if self.active_index.ntotal >= self.max_vectors:
+                self.rotate_shard()
+            
+            room = self.max_vectors - self.active_index.ntotal
+            chunk = vector[start:start + room]
+            chunk_ids = ids[start:start + len(chunk)]
+            self.active_index.add_with_ids(chunk, chunk_ids)
+            self.unsaved.append((chunk_ids, chunk))
+            if self.active_suffix_id in self.code_indices:
+                self.code_indices[self.active_suffix_id].add_with_ids(self.encoder.encode(chunk), chunk_ids)
+            start += len(chunk)
+            self.maybe_train()
+        self.maybe_train_codes()
 
 
-    def search(self, query_vector, k=1):
-        all_results = []
-        
+    def prepare_queries(self, query_vector):
         if len(query_vector.shape) == 1:
             query_vector = query_vector.reshape(1, -1)
         
-        if self.index_type == "binary":
-            query_vector = query_vector.astype(np.uint8)
-        else:
-            query_vector = query_vector.astype(np.float32)
+        if self.is_binary:
+            return np.ascontiguousarray(query_vector, dtype=np.uint8)
+        return np.ascontiguousarray(query_vector, dtype=np.float32)
+
+    def searchable_shards(self):
+        return [idx_obj for idx_obj, _ in self.indices if idx_obj.ntotal > 0]
+
+    def fan_out(self, search_shard, shards):
+        if len(shards) <= 1:
+            return [search_shard(shard) for shard in shards]
+        return list(get_search_pool().map(search_shard, shards))
+
+    def search_batch(self, query_vectors, k=1, nprobe=None, ef_search=None):
+        """
+        Searches (Q, d) queries against every shard concurrently.
+        Returns (D, I) arrays of shape (Q, k), best first; I holds catalog image
+        ids and is -1 where fewer than k results exist.
+        """
+        queries = self.prepare_queries(query_vectors)
+        if self.codes_ready():
+            return self.cascade_search(queries, k)
+        fetch_k = max(k, config.RERANK_DEPTH) if self.vector_store is not None else k
+        nprobe = nprobe or self.nprobe
+        ef_search = ef_search or self.ef_search
+        shards = self.searchable_shards()
         
-        current_offset = 0
+        if not shards:
+            empty_d = np.zeros((len(queries), 0), dtype=np.int32 if self.is_binary else np.float32)
+            return empty_d, np.zeros((len(queries), 0), dtype=np.int64)
         
-        for idx_obj, suffix_id in self.indices:
-            if idx_obj.ntotal == 0:
-                continue
-            
-            D, I = idx_obj.search(query_vector, min(k, idx_obj.ntotal))
-            
-            distances = D[0]
-            local_indices = I[0]
-            
-            for dist, local_idx in zip(distances, local_indices):
-                if local_idx != -1:
-                    global_idx = current_offset + local_idx
-                    if global_idx < len(self.paths):
-                        all_results.append((dist, global_idx))
-            
-            current_offset += idx_obj.ntotal
+        def search_shard(idx_obj):
+            shard_k = min(fetch_k, idx_obj.ntotal)
+            if self.is_binary:
+                return idx_obj.search(queries, shard_k)
+            params = fi.make_search_params(idx_obj, nprobe=nprobe, ef_search=ef_search)
+            return idx_obj.search(queries, shard_k, params=params)
         
-        if not all_results:
-            return []
+        results = self.fan_out(search_shard, shards)
+        D = np.hstack([r[0] for r in results])
+        I = np.hstack([r[1] for r in results])
         
-        if self.index_type == "binary":
-            best_k = heapq.nsmallest(k, all_results, key=lambda x: x[0])
+        invalid = I < 0
+        if self.is_binary:
+            D = np.where(invalid, np.iinfo(np.int32).max, D)
+            key = D
         else:
-            best_k = heapq.nlargest(k, all_results, key=lambda x: x[0])
+            D = np.where(invalid, -np.inf, D).astype(np.float32)
+            key = -D
+        
+        if self.vector_store is not None:
+            D = self.exact_scores(queries, I, D)
+            key = -D
+        
+        return select_top_k(D, I, key, k)
+
+    def cascade_search(self, queries, k):
+        # Hamming top-N over the binary codes (popcount only), then exact inner
+        # products for those N candidates from the full-precision store.
+        depth = max(k, config.PREFILTER_DEPTH)
+        codes = self.encoder.encode(queries)
+        shards = [code_index for code_index in self.code_indices.values() if code_index.ntotal > 0]
+        
+        if not shards:
+            return np.zeros((len(queries), 0), dtype=np.float32), np.zeros((len(queries), 0), dtype=np.int64)
+        
+        results = self.fan_out(lambda code_index: code_index.search(codes, min(depth, code_index.ntotal)), shards)
+        H = np.hstack([r[0] for r in results])
+        I = np.hstack([r[1] for r in results])
+        H = np.where(I < 0, np.iinfo(np.int32).max, H)
         
-        return best_k
+        if H.shape[1] > depth:
+            part = np.argpartition(H, depth - 1, axis=1)[:, :depth]
+            I = np.take_along_axis(I, part, axis=1)
+        
+        D = self.exact_scores(queries, I, np.full(I.shape, -np.inf, dtype=np.float32))
+        D, I = select_top_k(D, I, -D, k)
+        return D, np.where(np.isneginf(D), -1, I)
+
+    def exact_scores(self, queries, I, D):
+        # Inner products against the full-precision store; rows missing from
+        # the store (all zero) keep their approximate score.
+        stored = self.vector_store.get(I)
+        exact = np.einsum('qd,qkd->qk', queries, stored)
+        known = np.any(stored != 0, axis=2) & (I >= 0)
+        return np.where(known, exact, D).astype(np.float32)
+
+    def score_ids(self, query_vector, image_ids):
+        """
+        Similarity of one dense query to the given image ids only (e.g. the
+        candidates another index proposed): dot products against the
+        full-precision store where it has the rows, otherwise against the
+        shard vectors reconstructed by id. A search restricted by an
+        IDSelector is not used: PQ rejects it and HNSW/IVF drop ids outside
+        the visited graph or lists. Returns {image id: score}; ids missing
+        from the index are left out.
+        """
+        query = self.prepare_queries(query_vector)[:1]
+        ids = np.unique(np.asarray(image_ids, dtype=np.int64))
+        scores = {}
+
+        if self.vector_store is not None and len(ids):
+            stored = self.vector_store.get(ids)
+            known = np.any(stored != 0, axis=1)
+            for image_id, score in zip(ids[known], stored[known] @ query[0]):
+                scores[int(image_id)] = float(score)
+            ids = ids[~known]
+
+        if len(ids):
+            for found, vectors in self.fan_out(lambda idx_obj: fi.reconstruct_ids(idx_obj, ids),
+                                               self.searchable_shards()):
+                for image_id, score in zip(found, vectors @ query[0]):
+                    scores[int(image_id)] = max(float(score), scores.get(int(image_id), -np.inf))
+        return scores
+
+    def search(self, query_vector, k=1, nprobe=None, ef_search=None):
+        D, I = self.search_batch(self.prepare_queries(query_vector)[:1], k, nprobe=nprobe, ef_search=ef_search)
+        return [(D[0][j], int(I[0][j])) for j in range(I.shape[1]) if I[0][j] >= 0]
+
+    def range_search(self, query_vector, radius):
+        """
+        Every stored vector within `radius` of the query, nearest first.
+        Binary indices: Hamming distance <= radius. Dense indices: similarity >= radius.
+        A 2-D query returns one result list per row.
+        """
+        single = len(query_vector.shape) == 1 or query_vector.shape[0] == 1
+        queries = self.prepare_queries(query_vector)
+
+        if self.is_binary:
+            # faiss binary range search is strict (distance < radius)
+            faiss_radius = int(radius) + 1
+        else:
+            faiss_radius = float(radius)
+
+        def search_shard(idx_obj):
+            return idx_obj.range_search(queries, faiss_radius)
+
+        all_results = [[] for _ in range(len(queries))]
+        for lims, D, I in self.fan_out(search_shard, self.searchable_shards()):
+            for row in range(len(queries)):
+                lo, hi = lims[row], lims[row + 1]
+                row_d, row_i = D[lo:hi], I[lo:hi]
+                if self.vector_store is not None and hi > lo:
+                    row_d = self.exact_scores(queries[row:row + 1], row_i[None, :], row_d[None, :])[0]
+                    keep = row_d >= faiss_radius
+                    row_d, row_i = row_d[keep], row_i[keep]
+                all_results[row].extend(zip(row_d, row_i.tolist()))
+
+        for results in all_results:
+            results.sort(key=lambda x: x[0], reverse=not self.is_binary)
+
+        return all_results[0] if single else all_results
 
     def get_total_vectors(self):
         total = 0
@@ -0,0 +1,83 @@
+import os
+import sqlite3
+import threading
+import time
+
+from src import config
+from src.utils.digest import file_digest
+
+
+class IndexManifest:
+    """
+    Persistent record of which files are already in the indices,
+    keyed by path with size, mtime and content digest.
+    Entries are staged with record() and only written by commit(), which
+    callers run right after persisting the shards, so a crash never leaves
+    the manifest claiming vectors that were not saved.
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = str(db_path or config.INDEX_DIR / "manifest.sqlite")
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT, indexed_at REAL)"
+        )
+        self.conn.commit()
+
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.entries = {
+            path: (size, mtime_ns, digest)
+            for path, size, mtime_ns, digest in self.conn.execute("SELECT path, size, mtime_ns, digest FROM files")
+        }
+        print(f"Loaded manifest: {len(self.entries)} indexed files")
+
+    def needs_indexing(self, path, stat=None):
+        entry = self.entries.get(path)
+        if entry is None:
+            return True
+
+        if stat is None:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return False
+
+        size, mtime_ns, digest = entry
+        if size == stat.st_size and mtime_ns == stat.st_mtime_ns:
+            return False
+
+        # Touched but possibly unchanged: compare content before re-indexing.
+        try:
+            current = file_digest(path)
+        except OSError:
+            return False
+        if current == digest:
+            self.record(path, stat.st_size, stat.st_mtime_ns, digest)
+            return False
+        return True
+
+    def record(self, path, size, mtime_ns, digest):
+        with self.lock:
+            self.pending[path] = (size, mtime_ns, digest)
+
+    def commit(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+
+        now = time.time()
+        rows = [(path, size, mtime_ns, digest, now) for path, (size, mtime_ns, digest) in pending.items()]
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, digest, indexed_at) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+        self.entries.update(pending)
+        print(f"Manifest updated: {len(rows)} files")
+
+    def close(self):
+        self.commit()
+        self.conn.close()
@@ -1,87 +1,237 @@
 import os
 import sys
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
 
 from src import config
-from src.core.index_manager import IndexShardManager
-from src.utils import hasher as fph
+from src.core.index_manager import IndexShardManager, remove_image_rows
+from src.core.catalog import ImageCatalog
+from src.core.wal import WriteAheadLog, Checkpointer
+from src.core.verification_store import VerificationStore
 from src.utils import faiss_ops as fi
 from src.models import clip_engine as ct
 from src.models import dino_engine as dt
-from src.utils.verification import hist_match, get_feature_count
-
-phash_manager = None
-whash_manager = None
-clip_manager = None
-dino_manager = None
-
-def load_resources():
-    global phash_manager, whash_manager, clip_manager, dino_manager
-    
-    print("Loading indices...")
-    
-    if not config.INDEX_DIR.exists():
-        config.INDEX_DIR.mkdir(parents=True)
-        
-    phash_manager = IndexShardManager(str(config.INDEX_DIR), "phash", config.PHASH_BITS, index_type='binary')
-    whash_manager = IndexShardManager(str(config.INDEX_DIR), "whash", config.WHASH_BITS, index_type='binary')
-    
-    clip_manager = IndexShardManager(str(config.INDEX_DIR), "clip", config.CLIP_DIM, index_type='flat')
-    dino_manager = IndexShardManager(str(config.INDEX_DIR), "dino", config.DINO_DIM, index_type='flat')
-    
+from src.models import projection as pr
+from src.utils.verification import compare_features, extract_features
+from src.utils.image_context import ImageContext, as_context, embed_contexts
+
+catalog = None
+verification_store = None
+_managers = {}
+_resource_lock = threading.RLock()
+_wal = None
+_checkpointer = None
+_speculation_pool = None
+
+MANAGER_SPECS = {
+    "phash": (config.PHASH_BITS, config.HASH_INDEX_TYPE),
+    "whash": (config.WHASH_BITS, config.HASH_INDEX_TYPE),
+    "clip": (config.CLIP_DIM, config.DENSE_INDEX_TYPE),
+    "dino": (config.DINO_DIM, config.DENSE_INDEX_TYPE),
+}
+
+
+def get_catalog():
+    global catalog
+    if catalog is None:
+        with _resource_lock:
+            if catalog is None:
+                if not config.INDEX_DIR.exists():
+                    config.INDEX_DIR.mkdir(parents=True)
+                catalog = ImageCatalog()
+    return catalog
+
+
+def get_verification_store():
+    global verification_store
+    if not config.VERIFY_ENABLED:
+        return None
+    if verification_store is None:
+        with _resource_lock:
+            if verification_store is None:
+                verification_store = VerificationStore()
+    return verification_store
+
+
+def get_manager(name):
+    # Shards are opened on first use, so hash-only callers never map the
+    # CLIP/DINO indices and CLIP stays unloaded until a query needs it.
+    manager = _managers.get(name)
+    if manager is None:
+        with _resource_lock:
+            manager = _managers.get(name)
+            if manager is None:
+                dimension, index_type = MANAGER_SPECS[name]
+                if name in ("clip", "dino"):
+                    dimension = pr.output_dim(name, dimension)
+                print(f"Loading {name} indices...")
+                manager = IndexShardManager(str(config.INDEX_DIR), name, dimension,
+                                            index_type=index_type, catalog=get_catalog())
+                replay_wal(name, manager)
+                _managers[name] = manager
+    return manager
+
+
+def get_wal():
+    global _wal
+    if not config.WAL_ENABLED:
+        return None
+    if _wal is None:
+        with _resource_lock:
+            if _wal is None:
+                _wal = WriteAheadLog()
+    return _wal
+
+
+def start_checkpointer():
+    # Online adds are durable through the WAL; this thread folds them into the
+    # shard files in the background so replay stays short.
+    global _checkpointer
+    wal = get_wal()
+    with _resource_lock:
+        if wal is None or _checkpointer is not None:
+            return
+        _checkpointer = Checkpointer(wal, persist_indices)
+        _checkpointer.start()
+        atexit.register(shutdown)
+
+
+def shutdown():
+    global _checkpointer
+    if _checkpointer is not None:
+        _checkpointer.stop()
+        _checkpointer = None
+    persist_indices()
+
+
+def replay_wal(name, manager):
+    # Re-applies online adds logged after the last checkpoint of this index.
+    # Ids a shard already holds are skipped: a rotation, or a checkpoint that
+    # crashed before mark_checkpoint, can leave the shards ahead of the lsn.
+    # A re-indexed file is not: its old rows go and the logged ones are added,
+    # which gives the same shard whether or not it was ahead.
+    wal = get_wal()
+    if wal is None:
+        return
+    count = 0
+    present = None
+    for lsn, image_id, arrays in wal.replay(name):
+        if present is None:
+            present = manager.stored_ids()
+        position = np.searchsorted(present, image_id)
+        if "replaces" in arrays:
+            manager.remove_ids([image_id])
+        elif position < len(present) and present[position] == image_id:
+            continue
+        vectors = arrays[name]
+        if name in ("clip", "dino") and vectors.shape[-1] != manager.dimension:
+            # Logged before migrate_indices.py --pca projected the shards.
+            vectors = pr.project(name, np.array(vectors, dtype=np.float32))
+        manager.add(vectors, image_id)
+        count += 1
+    if count:
+        print(f"Replayed {count} WAL records into {name}")
+
+
+def load_resources(names=tuple(MANAGER_SPECS)):
+    for name in names:
+        get_manager(name)
     print("Resources loaded successfully")
 
-    if not hasattr(ct, 'model') or not hasattr(ct, 'processor'):
-        print("Warning: CLIP model/processor not found in clip_engine")
-    
-    if not hasattr(dt, 'model') or not hasattr(dt, 'processor'):
-        print("Warning: DINO model/processor not found in dino_engine")
-
 
-def resolve_path(path_entry):
-    path_entry = str(path_entry).replace("\\", "/")
-    
-    if os.path.exists(path_entry):
-        return os.path.abspath(path_entry)
-
-    candidate_images = config.IMAGE_DIR / os.path.basename(path_entry)
-    if candidate_images.exists():
-        return str(candidate_images.resolve())
-
-    if "/DejaView/" in path_entry:
-        relative_part = path_entry.split("/DejaView/", 1)[1]
-        candidate = config.PROJECT_ROOT / relative_part
-        if candidate.exists():
-            return str(candidate.resolve())
-
-    return os.path.abspath(path_entry)
+def warm_up(include_clip=False):
+    """
+    Loads the indices and models ahead of the first request (e.g. at server
+    start). CLIP is only used in the ambiguous DINO band, so it is left
+    lazy unless include_clip is set.
+    """
+    names = [name for name in MANAGER_SPECS if include_clip or name != "clip"]
+    load_resources(names)
+    dt.warm_up()
+    if include_clip:
+        ct.warm_up()
+
+
+def persist_indices():
+    """
+    Checkpoint: takes the rows every index gained since the last one while
+    adds are paused, appends them to the shard deltas outside the lock and
+    lets the WAL drop the segments all indices now contain.
+    """
+    wal = get_wal()
+    if wal is None:
+        for manager in list(_managers.values()):
+            manager.persist()
+        return
+
+    with _resource_lock:
+        lsn = wal.lsn
+        snapshots = {name: manager.snapshot() for name, manager in _managers.items() if manager.dirty}
+        loaded = list(_managers)
+    if not loaded:
+        return
+
+    wal.wait(lsn)
+    wal.rotate()
+    unwritten = dict(snapshots)
+    try:
+        for name, snapshot in snapshots.items():
+            _managers[name].write_snapshot(snapshot)
+            del unwritten[name]
+    except Exception:
+        with _resource_lock:
+            for name, snapshot in unwritten.items():
+                _managers[name].restore_snapshot(snapshot)
+        raise
+    wal.mark_checkpoint({name: lsn for name in loaded}, names=MANAGER_SPECS)
 
 
 def add_to_indices(image_path):
-    if phash_manager is None:
-        load_resources()
+    """
+    Computes every feature first, then logs the image to the WAL and applies
+    it to all four indices under one lock, so a failure in any stage leaves
+    the indices untouched. A path the catalog already has (a changed file
+    indexed again) has its old rows removed first, so it keeps one set of
+    rows under its id. Returns once the WAL record is on disk.
+    """
+    ctx = as_context(image_path)
+    image_path = ctx.path
 
     try:
-        augmented_hashes = fph.get_augmented_hashes(image_path)
-        
-        for p_hash, w_hash, aug_name in augmented_hashes:
-            ph_str = str(p_hash)
-            wh_str = str(w_hash)
-            
-            phash_vec = fi.hash_to_faiss_vector(ph_str)
-            whash_vec = fi.hash_to_faiss_vector(wh_str)
-            
-            phash_manager.add(phash_vec, image_path)
-            whash_manager.add(whash_vec, image_path)
-        
-        clip_emb = ct.get_clip_embedding(image_path)
-        clip_manager.add(clip_emb, image_path)
-
-        dino_emb = dt.get_dino_embedding(image_path)
-        dino_manager.add(dino_emb, image_path)
-
+        width, height = ctx.size
+        phash_vecs, whash_vecs = ctx.index_hash_vectors(config.HASH_AUGMENT_MODE)
+        clip_emb = ctx.clip_embedding
+        dino_emb = ctx.dino_embedding
+        if clip_emb is None or dino_emb is None:
+            raise ValueError("could not embed image")
+        vectors = {"phash": phash_vecs, "whash": whash_vecs, "clip": clip_emb, "dino": dino_emb}
+        store = get_verification_store()
+        features = ctx.verification_features if store is not None else None
+
+        managers = {name: get_manager(name) for name in MANAGER_SPECS}
+        wal = get_wal()
+        with _resource_lock:
+            catalog = get_catalog()
+            replaces = catalog.get_id(image_path) is not None
+            image_id = catalog.add(image_path, width, height)
+            if replaces:
+                # Logged as a replacement so replay also drops the old rows.
+                vectors["replaces"] = np.uint8(1)
+            lsn = wal.log(image_id, vectors) if wal is not None else None
+            if replaces:
+                remove_image_rows(managers.values(), [image_id], store)
+            for name, manager in managers.items():
+                manager.add(vectors[name], image_id)
+        if store is not None:
+            store.put(image_id, features)
+
+        if wal is not None:
+            wal.wait(lsn)
+            start_checkpointer()
         return True
     
     except Exception as e:
@@ -89,184 +239,546 @@ def add_to_indices(image_path):
         return False
 
     
-def check_phash(image_path):
-    if phash_manager is None:
-        return False, 0.0, None
-    
-    p_hash, _ = fph.pw_hash(image_path)
-    ph_str = str(p_hash)
-    ph_vec = fi.hash_to_faiss_vector(ph_str)
-    
-    results = phash_manager.search(ph_vec, 1)
-    
-    if not results:
+def hash_queries(ctx, kind):
+    # In "query" augmentation mode the index holds only original hashes, so the
+    # query brings its own seven rotations/flips and they are searched as one batch.
+    position = 0 if kind == "phash" else 1
+    if config.HASH_AUGMENT_MODE == "query":
+        hashes = [entry[position] for entry in ctx.augmented_hashes]
+    else:
+        hashes = [ctx.hashes[position]]
+    return np.vstack([fi.hash_to_faiss_vector(str(h)) for h in hashes])
+
+
+def nearest_hash_hits(manager, query_groups, threshold):
+    # One range search for every group's rows; per group the closest (dist, id) or None.
+    queries = np.vstack(query_groups)
+    rows = manager.range_search(queries, threshold)
+    if len(queries) == 1:
+        rows = [rows]
+
+    hits, offset = [], 0
+    for group in query_groups:
+        group_rows = [r for r in rows[offset:offset + len(group)] if r]
+        offset += len(group)
+        best = min(group_rows, key=lambda r: r[0][0], default=None)
+        hits.append(best[0] if best else None)
+    return hits
+
+
+def nearest_hash_hit(manager, queries, threshold):
+    return nearest_hash_hits(manager, [queries], threshold)[0]
+
+
+def hash_hit(hit, threshold):
+    if hit is None:
         return False, 0.0, None
 
-    dist, global_idx = results[0]
+    dist, image_id = hit
     
-    if dist <= config.PHASH_THRESHOLD:
+    if dist <= threshold:
         sim_pct = (1.0 - (dist / 64.0)) * 100.0
         
-        if global_idx < len(phash_manager.paths):
-            matched_path = resolve_path(phash_manager.paths[global_idx])
-            if os.path.exists(matched_path):
-                return True, round(sim_pct, 2), matched_path
-            else:
-                print(f"Warning: Index returned missing file: {matched_path}")
+        matched_path = get_catalog().get_path(image_id)
+        if matched_path is not None:
+            return True, round(sim_pct, 2), matched_path
     
     return False, 0.0, None
 
 
-def check_whash(image_path):
-    if whash_manager is None:
-        return False, 0.0, None
-    
-    _, w_hash = fph.pw_hash(image_path)
-    wh_str = str(w_hash)
-    wh_vec = fi.hash_to_faiss_vector(wh_str)
+def check_phash(image_path):
+    phash_manager = get_manager("phash")
     
-    results = whash_manager.search(wh_vec, 1)
+    ph_vecs = hash_queries(as_context(image_path), "phash")
+    return hash_hit(nearest_hash_hit(phash_manager, ph_vecs, config.PHASH_THRESHOLD), config.PHASH_THRESHOLD)
+
+
+def check_whash(image_path):
+    whash_manager = get_manager("whash")
     
-    if not results:
-        return False, 0.0, None
-        
-    dist, global_idx = results[0]
+    wh_vecs = hash_queries(as_context(image_path), "whash")
+    return hash_hit(nearest_hash_hit(whash_manager, wh_vecs, config.WHASH_THRESHOLD), config.WHASH_THRESHOLD)
+
+
+def dense_similarity(name, score):
+    # Raw CLIP/DINO score -> (reference-scale score, similarity %).
+    score = pr.to_reference_scale(name, score)
+    return score, round(score * 100.0, 2)
+
+
+def dense_hit(name, score, image_id, threshold):
+    """
+    Best CLIP/DINO hit -> (is_match, similarity %, matched path). Unlike the
+    hash checks, a miss still carries the similarity of the best neighbour
+    rather than 0.0: dense_verdict and check_images_chunk send DINO misses
+    from 20% up to the threshold on to verification and CLIP, and that band
+    is unreachable if every miss reports 0.
+    """
+    score, sim_pct = dense_similarity(name, score)
     
-    if dist <= config.WHASH_THRESHOLD:
-        sim_pct = (1.0 - (dist / 64.0)) * 100.0
-        
-        if global_idx < len(whash_manager.paths):
-            matched_path = resolve_path(whash_manager.paths[global_idx])
-            if os.path.exists(matched_path):
-                return True, round(sim_pct, 2), matched_path
-            else:
-                print(f"Warning: Index returned missing file: {matched_path}")
+    if score >= threshold:
+        matched_path = get_catalog().get_path(image_id)
+        if matched_path is not None:
+            return True, sim_pct, matched_path
     
-    return False, 0.0, None
+    return False, sim_pct, None
+
+
+def dino_candidate_k():
+    # How many DINO neighbours the later stages (verification, CLIP) look at
+    return max(config.VERIFY_TOP_K if config.VERIFY_ENABLED else 1, config.CLIP_CANDIDATE_K or 1)
+
+
+def clip_candidate_hit(ctx, emb):
+    """
+    CLIP restricted to the top CLIP_CANDIDATE_K DINO candidates: their CLIP
+    scores are looked up by id and fused with their DINO scores
+    (FUSION_WEIGHT on CLIP); the best fused candidate is judged on its CLIP
+    score. None when there are no candidates to score.
+    """
+    candidates = (ctx.candidates.get("dino") or [])[:config.CLIP_CANDIDATE_K]
+    if not config.CLIP_CANDIDATE_K or not candidates:
+        return None
+
+    clip_scores = get_manager("clip").score_ids(emb, [image_id for _, image_id in candidates])
+    best = None
+    for dino_score, image_id in candidates:
+        clip_score = clip_scores.get(int(image_id))
+        if clip_score is None:
+            continue
+        fused = (config.FUSION_WEIGHT * pr.to_reference_scale("clip", clip_score)
+                 + (1.0 - config.FUSION_WEIGHT) * pr.to_reference_scale("dino", dino_score))
+        if best is None or fused > best[0]:
+            best = (fused, clip_score, image_id)
+
+    if best is None:
+        return None
+    _, clip_score, image_id = best
+    return dense_hit("clip", clip_score, image_id, config.CLIP_THRESHOLD)
 
 
 def check_clip(image_path):
-    if clip_manager is None:
-        return False, 0.0, None
+    clip_manager = get_manager("clip")
     
-    emb = ct.get_clip_embedding(image_path)
+    ctx = as_context(image_path)
+    emb = ctx.clip_embedding
+    if emb is None:
+        return False, 0.0, None
+
+    hit = clip_candidate_hit(ctx, emb)
+    if hit is not None:
+        return hit
     
     results = clip_manager.search(emb, 1)
     
     if not results:
         return False, 0.0, None
         
-    score, global_idx = results[0]
-    
-    if score >= config.CLIP_THRESHOLD:
-        sim_pct = round(score * 100.0, 2)
-        
-        if global_idx < len(clip_manager.paths):
-            matched_path = resolve_path(clip_manager.paths[global_idx])
-            if os.path.exists(matched_path):
-                return True, sim_pct, matched_path
-            else:
-                print(f"Warning: Index returned missing file: {matched_path}")
-    
-    return False, 0.0, None
+    score, image_id = results[0]
+    return dense_hit("clip", score, image_id, config.CLIP_THRESHOLD)
 
 
 def check_dino(image_path):
-    if dino_manager is None:
-        return False, 0.0, None
+    dino_manager = get_manager("dino")
     
-    emb = dt.get_dino_embedding(image_path)
+    emb = as_context(image_path).dino_embedding
     if emb is None:
         return False, 0.0, None
     
-    results = dino_manager.search(emb, 1)
+    # The top neighbours stay on the context for check_verification and check_clip.
+    results = dino_manager.search(emb, dino_candidate_k())
+    ctx = as_context(image_path)
+    ctx.candidates["dino"] = results
     
     if not results:
         return False, 0.0, None
         
-    score, global_idx = results[0]
-    
-    if score >= config.DINO_THRESHOLD:
-        sim_pct = round(score * 100.0, 2)
-        
-        if global_idx < len(dino_manager.paths):
-            matched_path = resolve_path(dino_manager.paths[global_idx])
-            if os.path.exists(matched_path):
-                return True, sim_pct, matched_path
-            else:
-                print(f"Warning: Index returned missing file: {matched_path}")
-    
-    return False, 0.0, None
+    score, image_id = results[0]
+    return dense_hit("dino", score, image_id, config.DINO_THRESHOLD)
+
+
+def candidate_features(store, image_ids):
+    # Stored features of the candidates; ones indexed before the store existed
+    # are computed from disk once and saved.
+    features = store.get_many(image_ids)
+    missing = [image_id for image_id in image_ids if image_id not in features]
+    backfill = []
+    for image_id in missing:
+        path = get_catalog().get_path(image_id)
+        if path is None or not os.path.exists(path):
+            continue
+        try:
+            features[image_id] = extract_features(ImageContext(path).cv_data)
+            backfill.append((image_id, features[image_id]))
+        except Exception as e:
+            print(f"Cannot compute verification features for {path}: {e}")
+    store.put_many(backfill)
+    return features
+
+
+def check_verification(image_path):
+    """
+    Re-ranks the DINO candidates left by check_dino with the ORB/histogram
+    score of hist_match, from features stored at ingest. The query's
+    histograms are computed once and its ORB descriptors once per flip.
+    """
+    store = get_verification_store()
+    ctx = as_context(image_path)
+    candidates = ctx.candidates.get("dino") or []
+    if store is None or not candidates:
+        return False, 0.0, None
 
+    image_ids = [int(image_id) for _, image_id in candidates]
+    features = candidate_features(store, image_ids)
+    query = ctx.verification_query
 
-def check_image_pipeline(image_path):
+    best_score, best_id = 0.0, None
+    for image_id in image_ids:
+        if image_id not in features:
+            continue
+        score = compare_features(query, features[image_id])['total']
+        if score > best_score:
+            best_score, best_id = score, image_id
 
-    if not os.path.exists(image_path):
-        raise FileNotFoundError(f"Image not found: {image_path}")
-    
-    if phash_manager is None:
-        load_resources()
-    
-    result = {
+    if best_id is not None and best_score >= config.HIST_THRESHOLD:
+        matched_path = get_catalog().get_path(best_id)
+        if matched_path is not None:
+            return True, round(best_score * 100.0, 2), matched_path
+    return False, round(best_score * 100.0, 2), None
+
+
+def new_result(image_path):
+    return {
         "status": "Unique",
         "similarity_percentage": 0.0,
         "matched_image_path": None,
         "source_image_path": image_path,
         "method": None
     }
+
+
+def screen_image(ctx, result):
+    """
+    Cheap stages: the ORB structure gate and the pHash/wHash check.
+    Updates result and returns True when they already decide the image.
+    """
+    if structure_gate(ctx, result):
+        return True
+    return hash_verdict(check_phash(ctx), check_whash(ctx), result)
+
+
+def structure_gate(ctx, result):
+    if ctx.feature_count < config.STRUCTURE_CHECK_THRESHOLD:
+        result.update({
+            "status": "Rejected",
+            "similarity_percentage": 0.0,
+            "matched_image_path": None,
+            "method": "insufficient_features"
+        })
+        return True
+    return False
+
+
+def hash_verdict(phash_hit, whash_hit, result):
+    is_match1, sim_pct1, matched_path1 = phash_hit
+    is_match2, sim_pct2, matched_path2 = whash_hit
+
+    if(sim_pct1 > 92 and sim_pct2 > 92):
+        sim_pct=(sim_pct1+sim_pct2)/2
+        result.update({
+            "status": "Similar (pHash & wHash)",
+            "similarity_percentage": sim_pct,
+            "matched_image_path": matched_path1,
+            "method": "phash & whash"
+        })
+        return True
+    return False
+
+
+def dense_verdict(ctx, result, cancelled=None):
+    """
+    DINO decides; in its ambiguous band (20% up to the threshold) the DINO
+    candidates are first re-ranked by the verification features, then CLIP
+    gets the last word. Stops early once `cancelled` is set.
+    """
+    is_match, sim_pct, matched_path = check_dino(ctx)
+    if is_match:
+        result.update({
+            "status": "Similar",
+            "similarity_percentage": sim_pct,
+            "matched_image_path": matched_path,
+            "method": "DINO"
+        })
+        return
+    if sim_pct < 20 or (cancelled is not None and cancelled.is_set()):
+        return
+
+    is_match, score_pct, matched_path = check_verification(ctx)
+    if is_match:
+        result.update({
+            "status": "Similar",
+            "similarity_percentage": score_pct,
+            "matched_image_path": matched_path,
+            "method": "DINO + verification"
+        })
+        return
+    if cancelled is not None and cancelled.is_set():
+        return
+
+    is_match, sim_pct, matched_path = check_clip(ctx)
+    if is_match:
+        result.update({
+            "status": "Similar",
+            "similarity_percentage": sim_pct,
+            "matched_image_path": matched_path,
+            "method": "CLIP"
+        })
+
+
+def get_speculation_pool():
+    global _speculation_pool
+    if _speculation_pool is None:
+        with _resource_lock:
+            if _speculation_pool is None:
+                _speculation_pool = ThreadPoolExecutor(max_workers=config.SPECULATIVE_WORKERS,
+                                                       thread_name_prefix="speculative")
+    return _speculation_pool
+
+
+def dense_checks(ctx, cancelled):
+    # The dense stages on a worker, into a result of their own that is only
+    # merged when the hash stages leave the image undecided.
+    result = new_result(ctx.path)
+    dense_verdict(ctx, result, cancelled)
+    return result
+
+
+def check_image_pipeline(image_path, speculative=None):
+    """
+    ORB gate, pHash/wHash, DINO, then verification and CLIP for the
+    ambiguous DINO band. With speculative (default SPECULATIVE_PIPELINE)
+    the dense stages start on a worker as soon as the image is decoded and
+    run alongside the ORB and hash stages; their result is discarded when
+    the hashes decide.
+    """
+    if not os.path.exists(image_path):
+        raise FileNotFoundError(f"Image not found: {image_path}")
     
+    result = new_result(image_path)
+    ctx = ImageContext(image_path)
+    speculative = config.SPECULATIVE_PIPELINE if speculative is None else speculative
+
     try:
-        feature_count = get_feature_count(image_path)
-        if feature_count < config.STRUCTURE_CHECK_THRESHOLD:
-             result.update({
-                "status": "Rejected",
-                "similarity_percentage": 0.0,
-                "matched_image_path": None,
-                "method": "insufficient_features"
-            })
-             return result
-
-        is_match1, sim_pct1, matched_path1 = check_phash(image_path)
-        is_match2, sim_pct2, matched_path2 = check_whash(image_path)
-
-        if(sim_pct1 > 92 and sim_pct2 > 92):
-            sim_pct=(sim_pct1+sim_pct2)/2
-            result.update({
-                "status": "Similar (pHash & wHash)",
-                "similarity_percentage": sim_pct,
-                "matched_image_path": matched_path1,
-                "method": "phash & whash"
-            })
-            return result
-        
-        is_match, sim_pct, matched_path = check_dino(image_path)
-
-        if(sim_pct >= config.DINO_THRESHOLD*100):
-            result.update({
-                "status": "Similar",
-                "similarity_percentage": sim_pct,
-                "matched_image_path": matched_path,
-                "method": "DINO"
-            })
+        if not speculative:
+            if screen_image(ctx, result):
+                return result
+            dense_verdict(ctx, result)
             return result
-        elif(sim_pct < 20):
+
+        # Decode before forking so both threads share one RGB image.
+        ctx.rgb
+        cancelled = threading.Event()
+        dense = get_speculation_pool().submit(dense_checks, ctx, cancelled)
+        if screen_image(ctx, result):
+            cancelled.set()
+            dense.cancel()
             return result
+
+        dense_result = dense.result()
+        result.update({key: dense_result[key] for key in
+                       ("status", "similarity_percentage", "matched_image_path", "method")})
+        return result
+
+    except Exception as e:
+        print(f"Error processing image: {e}")
+        result["error"] = str(e)
+    
+    return result
+
+
+def dense_stage(contexts, rows, engine, kind, embed_many, k=1):
+    # One batched forward over rows (feature-cache misses only) and one (Q, d)
+    # search; yields (row, best score, image id) for rows with a neighbour and
+    # leaves the top k on each context.
+    if not rows:
+        return []
+    embeddings = embed_contexts([contexts[i] for i in rows], engine, kind, embed_many)
+    found = [(i, emb) for i, emb in zip(rows, embeddings) if emb is not None]
+    if not found:
+        return []
+    D, I = get_manager(kind).search_batch(np.vstack([emb for _, emb in found]), k)
+    if I.shape[1] == 0:
+        return []
+    for row, (i, _) in enumerate(found):
+        contexts[i].candidates[kind] = [(D[row, j], I[row, j]) for j in range(I.shape[1]) if I[row, j] >= 0]
+    return [(i, D[row, 0], I[row, 0]) for row, (i, _) in enumerate(found) if I[row, 0] >= 0]
+
+
+def clip_stage(contexts, rows):
+    # One batched CLIP forward; rows with DINO candidates score just those,
+    # the rest share one full CLIP search. Returns (row, hit) pairs.
+    embeddings = embed_contexts([contexts[i] for i in rows], ct, "clip", ct.get_clip_embeddings)
+    hits, full = [], []
+    for i, emb in zip(rows, embeddings):
+        if emb is None:
+            continue
+        hit = clip_candidate_hit(contexts[i], emb)
+        if hit is None:
+            full.append(i)
+        else:
+            hits.append((i, hit))
+
+    for i, score, image_id in dense_stage(contexts, full, ct, "clip", ct.get_clip_embeddings):
+        hits.append((i, dense_hit("clip", score, image_id, config.CLIP_THRESHOLD)))
+    return hits
+
+
+def screen_images(contexts, rows, results):
+    # ORB gate and hash variants per image on a thread pool (OpenCV releases
+    # the GIL), then one pHash and one wHash range search for all survivors.
+    # Returns the rows still undecided.
+    def prepare(i):
+        try:
+            if structure_gate(contexts[i], results[i]):
+                return i, None
+            return i, (hash_queries(contexts[i], "phash"), hash_queries(contexts[i], "whash"))
+        except Exception as e:
+            print(f"Error processing image: {e}")
+            results[i]["error"] = str(e)
+            return i, None
+
+    with ThreadPoolExecutor(max_workers=config.INDEX_WORKERS) as pool:
+        survivors = [(i, queries) for i, queries in pool.map(prepare, rows) if queries is not None]
+    if not survivors:
+        return []
+
+    ph_hits = nearest_hash_hits(get_manager("phash"), [q[0] for _, q in survivors], config.PHASH_THRESHOLD)
+    wh_hits = nearest_hash_hits(get_manager("whash"), [q[1] for _, q in survivors], config.WHASH_THRESHOLD)
+
+    pending = []
+    for (i, _), ph_hit, wh_hit in zip(survivors, ph_hits, wh_hits):
+        if not hash_verdict(hash_hit(ph_hit, config.PHASH_THRESHOLD), hash_hit(wh_hit, config.WHASH_THRESHOLD),
+                            results[i]):
+            pending.append(i)
+    return pending
+
+
+def check_images_pipeline(image_paths, chunk_size=None):
+    """
+    Batched check_image_pipeline: each funnel stage runs once per chunk over
+    the images the previous stage left undecided (ORB gate, hash search,
+    DINO, then verification and CLIP for the ambiguous band). Returns one result dict per
+    path, in input order.
+    """
+    chunk_size = chunk_size or config.PIPELINE_CHUNK_SIZE
+    results = []
+    for start in range(0, len(image_paths), chunk_size):
+        results.extend(check_images_chunk(list(image_paths[start:start + chunk_size])))
+    return results
+
+
+def check_images_chunk(image_paths):
+    results = [new_result(path) for path in image_paths]
+    contexts = [ImageContext(path) for path in image_paths]
+
+    rows = []
+    for i, path in enumerate(image_paths):
+        if os.path.exists(path):
+            rows.append(i)
         else:
-            is_match, sim_pct, matched_path = check_clip(image_path)
+            results[i]["error"] = f"Image not found: {path}"
+
+    try:
+        pending = screen_images(contexts, rows, results)
+
+        ambiguous = []
+        for i, score, image_id in dense_stage(contexts, pending, dt, "dino", dt.get_dino_embeddings,
+                                              dino_candidate_k()):
+            is_match, sim_pct, matched_path = dense_hit("dino", score, image_id, config.DINO_THRESHOLD)
+            if is_match:
+                results[i].update({
+                    "status": "Similar",
+                    "similarity_percentage": sim_pct,
+                    "matched_image_path": matched_path,
+                    "method": "DINO"
+                })
+            elif sim_pct >= 20:
+                ambiguous.append(i)
+
+        unverified = []
+        for i in ambiguous:
+            is_match, score_pct, matched_path = check_verification(contexts[i])
+            if is_match:
+                results[i].update({
+                    "status": "Similar",
+                    "similarity_percentage": score_pct,
+                    "matched_image_path": matched_path,
+                    "method": "DINO + verification"
+                })
+            else:
+                unverified.append(i)
+
+        for i, (is_match, sim_pct, matched_path) in clip_stage(contexts, unverified):
             if is_match:
-                result.update({
+                results[i].update({
                     "status": "Similar",
                     "similarity_percentage": sim_pct,
                     "matched_image_path": matched_path,
                     "method": "CLIP"
                 })
-            return result
 
     except Exception as e:
-        print(f"Error processing image: {e}")
-        result["error"] = str(e)
-    
-    return result
+        print(f"Error processing batch: {e}")
+        for result in results:
+            if result["status"] == "Unique":
+                result["error"] = str(e)
+
+    return results
+
+
+def pair_hash_hit(dist, threshold):
+    # hash_hit for two images compared directly instead of through the index
+    if dist <= threshold:
+        return True, round((1.0 - dist / 64.0) * 100.0, 2), None
+    return False, 0.0, None
 
 
-load_resources()
\ No newline at end of file
+def pair_verdict(ctx, emb, earlier, earlier_emb):
+    # The pHash & wHash and DINO stages of the funnel for one pair of images;
+    # the earlier image's augmented hashes stand in for its index rows.
+    result = {}
+    phash_dist = min(ctx.phash - p for p, _, _ in earlier.augmented_hashes)
+    whash_dist = min(ctx.whash - w for _, w, _ in earlier.augmented_hashes)
+    if hash_verdict(pair_hash_hit(phash_dist, config.PHASH_THRESHOLD),
+                    pair_hash_hit(whash_dist, config.WHASH_THRESHOLD), result):
+        return result
+    if emb is not None and earlier_emb is not None:
+        score, sim_pct = dense_similarity("dino", float(emb[0] @ earlier_emb[0]))
+        if score >= config.DINO_THRESHOLD:
+            return {"status": "Similar", "similarity_percentage": sim_pct, "method": "DINO"}
+    return None
+
+
+def batch_repeats(image_paths):
+    """
+    For images that each came back Unique from one batched check (e.g. an
+    upload batch), which of them repeat an image earlier in the list that
+    would be stored first. Each is compared only with those earlier images,
+    on the hashes and DINO embeddings the check already computed, so no
+    second pass over the index is needed. Returns None or (earlier position,
+    result fields) per path; the verification/CLIP band is not repeated.
+    """
+    contexts = [ImageContext(path) for path in image_paths]
+    embeddings = embed_contexts(contexts, dt, "dino", dt.get_dino_embeddings) if contexts else []
+    repeats, kept = [], []
+    for i, ctx in enumerate(contexts):
+        repeat = None
+        for j in kept:
+            fields = pair_verdict(ctx, embeddings[i], contexts[j], embeddings[j])
+            if fields is not None:
+                repeat = (j, fields)
+                break
+        repeats.append(repeat)
+        if repeat is None:
+            kept.append(i)
+    return repeats
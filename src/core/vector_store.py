@@ -0,0 +1,67 @@
+import os
+import threading
+
+import numpy as np
+
+
+class VectorStore:
+    """
+    Full-precision float32 vectors on disk, one row per catalog image id.
+    Compressed or ANN shards return candidates; their exact scores are
+    recomputed from this memory-mapped file, so only the rows actually
+    re-ranked are paged in. Rows never written read back as zeros.
+    """
+
+    def __init__(self, path, dimension, grow_rows=65536):
+        self.path = str(path)
+        self.dimension = dimension
+        self.grow_rows = grow_rows
+        self.row_bytes = dimension * 4
+        self.lock = threading.Lock()
+        self.data = None
+        self.capacity = 0
+
+        if not os.path.exists(self.path):
+            open(self.path, "wb").close()
+        self._map()
+
+    def _map(self):
+        self.capacity = os.path.getsize(self.path) // self.row_bytes
+        if self.capacity:
+            self.data = np.memmap(self.path, dtype=np.float32, mode="r+", shape=(self.capacity, self.dimension))
+        else:
+            self.data = None
+
+    def _ensure_capacity(self, max_id):
+        if max_id < self.capacity:
+            return
+        rows = max(max_id + 1, self.capacity + self.grow_rows)
+        if self.data is not None:
+            self.data.flush()
+            self.data = None
+        with open(self.path, "r+b") as f:
+            f.truncate(rows * self.row_bytes)
+        self._map()
+
+    def put(self, ids, vectors):
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), self.dimension)
+        if not len(ids):
+            return
+        with self.lock:
+            self._ensure_capacity(int(ids.max()))
+            self.data[ids] = vectors
+
+    def get(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        out = np.zeros(ids.shape + (self.dimension,), dtype=np.float32)
+        with self.lock:
+            valid = (ids >= 0) & (ids < self.capacity)
+            if valid.any():
+                out[valid] = self.data[ids[valid]]
+        return out
+
+    def flush(self):
+        with self.lock:
+            if self.data is not None:
+                self.data.flush()
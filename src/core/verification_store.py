@@ -0,0 +1,91 @@
+import sqlite3
+import threading
+
+import numpy as np
+
+from src import config
+
+# Bump when extract_features changes so stale rows are recomputed.
+FEATURE_VERSION = "orb500-ransac-hist-2"
+
+GRAY_BINS = (50, 1)
+HSV_BINS = (30, 10)
+
+
+class VerificationStore:
+    """
+    Per-image verification features keyed by catalog id: ORB keypoint
+    positions (float32) and descriptors (uint8, up to ORB_FEATURES x 32) and
+    the gray/HSV histograms as float16.
+    Written at ingest, so re-ranking dense candidates never reopens their
+    image files.
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = str(db_path or config.INDEX_DIR / "verification.sqlite")
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS features ("
+            "id INTEGER PRIMARY KEY, version TEXT, descriptors BLOB, gray_hist BLOB, hsv_hist BLOB)"
+        )
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(features)")}
+        if "points" not in columns:
+            # Rows from before keypoints were stored carry an older version and are recomputed.
+            self.conn.execute("ALTER TABLE features ADD COLUMN points BLOB")
+        self.conn.commit()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def encode(features):
+        return (
+            FEATURE_VERSION,
+            np.ascontiguousarray(features["descriptors"], dtype=np.uint8).tobytes(),
+            np.asarray(features["gray_hist"], dtype=np.float16).tobytes(),
+            np.asarray(features["hsv_hist"], dtype=np.float16).tobytes(),
+            np.ascontiguousarray(features["points"], dtype=np.float32).tobytes(),
+        )
+
+    @staticmethod
+    def decode(descriptors, gray_hist, hsv_hist, points):
+        # cv2.compareHist wants float32 histograms of the original shape
+        return {
+            "points": np.frombuffer(points, dtype=np.float32).reshape(-1, 2),
+            "descriptors": np.frombuffer(descriptors, dtype=np.uint8).reshape(-1, 32),
+            "gray_hist": np.frombuffer(gray_hist, dtype=np.float16).astype(np.float32).reshape(GRAY_BINS),
+            "hsv_hist": np.frombuffer(hsv_hist, dtype=np.float16).astype(np.float32).reshape(HSV_BINS),
+        }
+
+    def put_many(self, items):
+        rows = [(int(image_id),) + self.encode(features) for image_id, features in items]
+        if not rows:
+            return
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO features (id, version, descriptors, gray_hist, hsv_hist, points) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def put(self, image_id, features):
+        self.put_many([(image_id, features)])
+
+    def delete_many(self, image_ids):
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM features WHERE id = ?", [(int(image_id),) for image_id in image_ids])
+
+    def get_many(self, image_ids):
+        ids = [int(image_id) for image_id in image_ids]
+        if not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT id, descriptors, gray_hist, hsv_hist, points FROM features "
+                f"WHERE version = ? AND id IN ({placeholders})",
+                [FEATURE_VERSION] + ids
+            ).fetchall()
+        return {row[0]: self.decode(*row[1:]) for row in rows}
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,283 @@
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from src import config
+
+RECORD_HEADER = struct.Struct("<II")  # payload length, crc32 of the payload
+PAYLOAD_HEADER = struct.Struct("<QqI")  # lsn, image id, length of the json array table
+
+
+def encode_record(lsn, image_id, arrays):
+    table = []
+    blobs = []
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        table.append([name, array.dtype.str, list(array.shape)])
+        blobs.append(array.tobytes())
+    meta = json.dumps(table).encode()
+    payload = PAYLOAD_HEADER.pack(lsn, int(image_id), len(meta)) + meta + b"".join(blobs)
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_record(payload):
+    lsn, image_id, meta_len = PAYLOAD_HEADER.unpack_from(payload)
+    offset = PAYLOAD_HEADER.size
+    table = json.loads(payload[offset:offset + meta_len])
+    offset += meta_len
+
+    arrays = {}
+    for name, dtype, shape in table:
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        arrays[name] = np.frombuffer(payload, dtype=dtype, count=count, offset=offset).reshape(shape)
+        offset += count * dtype.itemsize
+    return lsn, image_id, arrays
+
+
+def iter_records(data):
+    # (end offset, payload) of each intact record, stopping at the first torn
+    # or corrupt one, which can only be the tail a crash left behind.
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        length, crc = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        payload = data[start:start + length]
+        if len(payload) != length or zlib.crc32(payload) != crc:
+            return
+        offset = start + length
+        yield offset, payload
+
+
+def read_segment(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    for _, payload in iter_records(data):
+        yield decode_record(payload)
+
+
+def repair_segment(path):
+    # Cuts a torn tail off and returns the last intact lsn (or None).
+    with open(path, "rb") as f:
+        data = f.read()
+    end, last_lsn = 0, None
+    for end, payload in iter_records(data):
+        last_lsn = PAYLOAD_HEADER.unpack_from(payload)[0]
+    if end < len(data):
+        print(f"WAL: dropping {len(data) - end} torn bytes at the end of {os.path.basename(path)}")
+        with open(path, "r+b") as f:
+            f.truncate(end)
+    return last_lsn
+
+
+class WriteAheadLog:
+    """
+    Append-only log of index mutations (image id plus its pHash/wHash rows
+    and CLIP/DINO embeddings), one record per image, numbered by a log
+    sequence number (lsn). Records are queued with log() and made durable by
+    wait(): the first waiter writes everything queued so far with one write
+    and one fsync while the others wait for it (group commit). Checkpoints
+    store, per index, the last lsn contained in its saved shards; replay()
+    only returns newer records, and segments every index has moved past are
+    deleted.
+    """
+
+    def __init__(self, root=None, group_commit_ms=None, fsync=None, segment_bytes=None):
+        self.root = str(root or config.WAL_DIR)
+        self.group_commit = (group_commit_ms if group_commit_ms is not None else config.WAL_GROUP_COMMIT_MS) / 1000.0
+        self.fsync = config.WAL_FSYNC if fsync is None else fsync
+        self.segment_bytes = segment_bytes or config.WAL_SEGMENT_MB * 1024 * 1024
+        os.makedirs(self.root, exist_ok=True)
+
+        self.cond = threading.Condition()
+        self.pending = []
+        self.flushing = False
+        self.error = None
+        self.bytes_since_checkpoint = 0
+        self.checkpoint_due = threading.Event()
+
+        self.checkpoints = self._load_checkpoints()
+        last_lsn = 0
+        segments = self.segments()
+        if segments:
+            first_lsn, path = segments[-1]
+            last_lsn = repair_segment(path) or first_lsn - 1
+        self.lsn = max([last_lsn] + list(self.checkpoints.values()))
+        self.durable = self.lsn
+
+        self.file = None
+        self._open_segment(self.lsn + 1)
+
+    def checkpoint_path(self):
+        return os.path.join(self.root, "checkpoint.json")
+
+    def segment_path(self, first_lsn):
+        return os.path.join(self.root, f"wal_{first_lsn:016d}.log")
+
+    def segments(self):
+        # (first lsn, path) of every segment, oldest first.
+        found = []
+        for name in os.listdir(self.root):
+            if name.startswith("wal_") and name.endswith(".log"):
+                found.append((int(name[4:-4]), os.path.join(self.root, name)))
+        return sorted(found)
+
+    def _load_checkpoints(self):
+        if not os.path.exists(self.checkpoint_path()):
+            return {}
+        with open(self.checkpoint_path()) as f:
+            return {name: int(lsn) for name, lsn in json.load(f).items()}
+
+    def _open_segment(self, first_lsn):
+        if self.file is not None:
+            self.file.close()
+        self.file = open(self.segment_path(first_lsn), "ab")
+
+    def _write(self, batch):
+        data = b"".join(batch)
+        self.file.write(data)
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.bytes_since_checkpoint += len(data)
+        if self.bytes_since_checkpoint >= config.WAL_CHECKPOINT_MB * 1024 * 1024:
+            self.checkpoint_due.set()
+
+    def log(self, image_id, arrays):
+        """
+        Queues one record and returns its lsn. Callers hold their write lock
+        here so lsn order is the order the mutation is applied in memory.
+        """
+        with self.cond:
+            if self.error is not None:
+                raise IOError(f"WAL is unusable after a failed write: {self.error}")
+            self.lsn += 1
+            self.pending.append(encode_record(self.lsn, image_id, arrays))
+            return self.lsn
+
+    def wait(self, lsn):
+        # Blocks until lsn is on disk, leading a group flush if nobody else is.
+        with self.cond:
+            while self.durable < lsn:
+                if self.error is not None:
+                    raise IOError(f"WAL write failed: {self.error}")
+                if self.flushing:
+                    self.cond.wait()
+                    continue
+
+                self.flushing = True
+                self.cond.release()
+                upto, error = None, None
+                try:
+                    if self.group_commit > 0:
+                        time.sleep(self.group_commit)
+                    with self.cond:
+                        batch, self.pending = self.pending, []
+                        upto = self.lsn
+                    self._write(batch)
+                    if self.file.tell() >= self.segment_bytes:
+                        self._open_segment(upto + 1)
+                except OSError as e:
+                    error = e
+                finally:
+                    self.cond.acquire()
+                    self.flushing = False
+                    if error is None and upto is not None:
+                        self.durable = max(self.durable, upto)
+                    elif error is not None:
+                        self.error = error
+                    self.cond.notify_all()
+
+    def append(self, image_id, arrays):
+        lsn = self.log(image_id, arrays)
+        self.wait(lsn)
+        return lsn
+
+    def rotate(self):
+        # Starts a new segment so the records logged so far can be deleted
+        # once every index has checkpointed past them.
+        with self.cond:
+            while self.flushing:
+                self.cond.wait()
+            if self.pending:
+                batch, self.pending = self.pending, []
+                self._write(batch)
+                self.durable = self.lsn
+                self.cond.notify_all()
+            self._open_segment(self.lsn + 1)
+
+    def checkpoint_lsn(self, name):
+        return self.checkpoints.get(name, 0)
+
+    def mark_checkpoint(self, lsns, names):
+        """
+        Records the lsn each index's saved shards now include and deletes
+        segments older than the least advanced of `names`.
+        """
+        self.checkpoints.update(lsns)
+        tmp_path = self.checkpoint_path() + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.checkpoints, f)
+        os.replace(tmp_path, self.checkpoint_path())
+
+        floor = min(self.checkpoint_lsn(name) for name in names)
+        segments = self.segments()
+        for (first_lsn, path), (next_lsn, _) in zip(segments, segments[1:]):
+            if next_lsn - 1 <= floor:
+                os.remove(path)
+        with self.cond:
+            self.bytes_since_checkpoint = 0
+            self.checkpoint_due.clear()
+
+    def replay(self, name):
+        # Records the checkpoint of index `name` does not contain yet, in lsn order.
+        after = self.checkpoint_lsn(name)
+        for _, path in self.segments():
+            for lsn, image_id, arrays in read_segment(path):
+                if lsn > after:
+                    yield lsn, image_id, arrays
+
+    def close(self):
+        with self.cond:
+            while self.flushing:
+                self.cond.wait()
+            if self.pending:
+                batch, self.pending = self.pending, []
+                self._write(batch)
+                self.durable = self.lsn
+            self.file.close()
+
+
+class Checkpointer(threading.Thread):
+    """
+    Background thread running checkpoint() every `interval` seconds, or
+    sooner once the log has grown by WAL_CHECKPOINT_MB since the last one.
+    """
+
+    def __init__(self, wal, checkpoint, interval=None):
+        super().__init__(name="wal-checkpointer", daemon=True)
+        self.wal = wal
+        self.checkpoint = checkpoint
+        self.interval = interval or config.WAL_CHECKPOINT_SECONDS
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.wal.checkpoint_due.wait(self.interval)
+            if self.stopped.is_set():
+                break
+            try:
+                self.checkpoint()
+            except Exception as e:
+                print(f"Error in background checkpoint: {e}")
+                self.wal.checkpoint_due.clear()
+
+    def stop(self):
+        self.stopped.set()
+        self.wal.checkpoint_due.set()
+        self.join()
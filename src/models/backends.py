@@ -0,0 +1,196 @@
+import numpy as np
+import torch
+
+from src import config
+from src.models.pooling import gem
+
+BACKENDS = ("torch", "torchscript", "int8", "onnx")
+INPUT_SHAPE = (3, 224, 224)
+
+
+class VisionEmbedder(torch.nn.Module):
+    """
+    Encoder + register/CLS token drop + GeM pooling as one module, so every
+    backend exports and runs the exact same graph.
+    """
+
+    def __init__(self, encoder, skip_tokens):
+        super().__init__()
+        self.encoder = encoder
+        self.skip_tokens = skip_tokens
+
+    def forward(self, pixel_values):
+        last_hidden_state = self.encoder(pixel_values=pixel_values, return_dict=False)[0]
+        return gem(last_hidden_state[:, self.skip_tokens:, :])
+
+
+def export_path(name, backend):
+    extension = "onnx" if backend == "onnx" else "pt"
+    export_dir = config.MODEL_DIR / "exports"
+    export_dir.mkdir(parents=True, exist_ok=True)
+    return export_dir / f"{name}_{backend}.{extension}"
+
+
+def example_inputs(batch_size=2, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    return torch.randn((batch_size,) + INPUT_SHAPE, generator=generator)
+
+
+class TorchRunner:
+    def __init__(self, module, device):
+        self.module = module
+        self.device = device
+
+    def __call__(self, pixel_values):
+        with torch.inference_mode():
+            out = self.module(pixel_values.to(self.device))
+        return out.float().cpu().numpy().astype('float32')
+
+
+class OnnxRunner:
+    def __init__(self, session):
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+
+    def __call__(self, pixel_values):
+        if isinstance(pixel_values, torch.Tensor):
+            pixel_values = pixel_values.detach().cpu().numpy()
+        out = self.session.run(None, {self.input_name: pixel_values.astype('float32')})[0]
+        return out.astype('float32')
+
+
+def module_device(module):
+    # Where the module's weights live; CPU for one without parameters.
+    parameter = next(module.parameters(), None)
+    return parameter.device if parameter is not None else torch.device("cpu")
+
+
+def trace(module, path, freeze=True):
+    # The example batch goes where the weights are: a CUDA module traced with
+    # CPU tensors fails and the runner would fall back to eager torch.
+    with torch.no_grad():
+        traced = torch.jit.trace(module, example_inputs().to(module_device(module)), check_trace=False)
+    if freeze:
+        traced = torch.jit.freeze(traced.eval())
+    torch.jit.save(traced, str(path))
+    return traced
+
+
+def build_torchscript(name, embedder, device):
+    path = export_path(name, "torchscript")
+    if path.exists():
+        print(f"Loading TorchScript {name} from {path}")
+        return TorchRunner(torch.jit.load(str(path), map_location=device), device)
+
+    print(f"Tracing {name} to TorchScript at {path}")
+    return TorchRunner(trace(embedder.to(device), path), device)
+
+
+def build_int8(name, embedder):
+    # Dynamic int8 quantization of every nn.Linear (attention projections and
+    # MLPs hold nearly all ViT FLOPs). Quantized kernels are CPU only.
+    path = export_path(name, "int8")
+    if path.exists():
+        print(f"Loading int8 {name} from {path}")
+        return TorchRunner(torch.jit.load(str(path), map_location="cpu"), "cpu")
+
+    print(f"Quantizing {name} linear layers to int8 at {path}")
+    quantized = torch.ao.quantization.quantize_dynamic(
+        embedder.to("cpu"), {torch.nn.Linear}, dtype=torch.qint8
+    )
+    return TorchRunner(trace(quantized, path, freeze=False), "cpu")
+
+
+def build_onnx(name, embedder):
+    try:
+        import onnxruntime as ort
+    except ImportError:
+        print("onnxruntime is not installed; pip install onnxruntime to use the onnx backend")
+        return None
+
+    path = export_path(name, "onnx")
+    if not path.exists():
+        print(f"Exporting {name} to ONNX at {path}")
+        with torch.no_grad():
+            torch.onnx.export(
+                embedder.to("cpu"), (example_inputs(),), str(path),
+                input_names=["pixel_values"], output_names=["embedding"],
+                dynamic_axes={"pixel_values": {0: "batch"}, "embedding": {0: "batch"}},
+                opset_version=17,
+            )
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    providers = [p for p in ("CUDAExecutionProvider", "CPUExecutionProvider") if p in ort.get_available_providers()]
+    return OnnxRunner(ort.InferenceSession(str(path), options, providers=providers))
+
+
+def cosine_agreement(reference, candidate):
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    return float(np.min(np.sum(reference * candidate, axis=1)))
+
+
+def validation_inputs(samples, preprocess=None):
+    # Real photos through the engine's own preprocessing: int8 and ONNX drift
+    # shows up on natural-image activations that Gaussian noise never produces.
+    if preprocess is not None and config.BACKEND_VALIDATION_DIR.is_dir():
+        paths = sorted(
+            str(path) for path in config.BACKEND_VALIDATION_DIR.iterdir()
+            if path.suffix.lower() in (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+        )[:samples]
+        if paths:
+            return preprocess(paths)
+    print(f"No validation images in {config.BACKEND_VALIDATION_DIR}, validating on noise")
+    return example_inputs(samples, seed=1)
+
+
+def validate(name, backend, runner, baseline, samples=None, tolerance=None, preprocess=None):
+    samples = samples or config.BACKEND_VALIDATION_SAMPLES
+    tolerance = tolerance if tolerance is not None else config.BACKEND_COSINE_TOLERANCE
+    pixel_values = validation_inputs(samples, preprocess)
+
+    agreement = cosine_agreement(baseline(pixel_values), runner(pixel_values))
+    print(f"{name} {backend} backend: min cosine to fp32 = {agreement:.4f}")
+    return agreement >= tolerance
+
+
+def build_runner(name, embedder, device, backend=None, preprocess=None):
+    """
+    Returns a callable pixel_values -> (N, dim) float32 pooled embeddings
+    (not yet L2 normalised) for the requested backend. Exported backends are
+    cached under MODEL_DIR/exports and checked against eager fp32 on the
+    BACKEND_VALIDATION_DIR images, run through `preprocess` (image paths ->
+    pixel_values); one that fails to build or drifts past
+    BACKEND_COSINE_TOLERANCE falls back to torch. Delete the cached export
+    after changing the model to rebuild it.
+    """
+    backend = backend or config.INFERENCE_BACKEND
+    embedder = embedder.eval()
+    baseline = TorchRunner(embedder.to(device), device)
+    if backend == "torch":
+        return baseline
+    if backend not in BACKENDS:
+        print(f"Unknown inference backend {backend}, using torch")
+        return baseline
+
+    try:
+        if backend == "torchscript":
+            runner = build_torchscript(name, embedder, device)
+        elif backend == "int8":
+            runner = build_int8(name, embedder)
+        else:
+            runner = build_onnx(name, embedder)
+        embedder.to(device)
+    except Exception as e:
+        print(f"Failed to build {backend} backend for {name} on {device}, falling back to torch: "
+              f"{type(e).__name__}: {e}")
+        embedder.to(device)
+        return baseline
+
+    if runner is None:
+        return baseline
+    if not validate(name, backend, runner, baseline, preprocess=preprocess):
+        print(f"{name} {backend} backend is outside the cosine tolerance, using torch")
+        return baseline
+    return runner
@@ -0,0 +1,51 @@
+from src import config
+
+OOM_MARKERS = ("out of memory", "can't allocate memory")
+
+
+def activation_mb_per_image(model_config, image_size=224):
+    # Peak live activations of one ViT block for one image: hidden states,
+    # the MLP expansion and one attention map per head, all in fp32.
+    patch_size = getattr(model_config, "patch_size", 14)
+    hidden = getattr(model_config, "hidden_size", 768)
+    heads = getattr(model_config, "num_attention_heads", 12)
+    seq_len = (image_size // patch_size) ** 2 + 1
+    floats = seq_len * hidden * 6 + heads * seq_len * seq_len
+    return floats * 4 / (1024 * 1024)
+
+
+def resolve_batch_size(batch_size, model_config, image_size=224):
+    if batch_size is None:
+        batch_size = config.EMBED_BATCH_SIZE
+    per_image = activation_mb_per_image(model_config, image_size)
+    budget_cap = max(1, int(config.EMBED_MEMORY_BUDGET_MB // per_image))
+    return max(1, min(batch_size, budget_cap))
+
+
+def is_oom_error(error):
+    message = str(error).lower()
+    return any(marker in message for marker in OOM_MARKERS)
+
+
+def run_chunked(forward, items, batch_size):
+    """
+    Calls forward on consecutive slices of items and returns the list of outputs.
+    A slice that runs out of memory is retried at half the batch size.
+    """
+    outputs = []
+    start = 0
+    while start < len(items):
+        chunk = items[start:start + batch_size]
+        try:
+            outputs.append(forward(chunk))
+        except RuntimeError as e:
+            if batch_size == 1 or not is_oom_error(e):
+                raise
+            batch_size = max(1, batch_size // 2)
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+            print(f"Out of memory, retrying with batch size {batch_size}")
+            continue
+        start += len(chunk)
+    return outputs
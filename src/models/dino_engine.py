@@ -1,17 +1,20 @@
 import os
 import sys
+import threading
 import numpy as np
-import torch
 import src.utils.faiss_ops as fi
 from PIL import Image
-from transformers import AutoImageProcessor, AutoModel
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../')))
 
 from src import config
-from src.models.pooling import gem
+from src.models.batching import resolve_batch_size, run_chunked
+from src.models import projection
+from src.models import preprocessing as pp
 
 def load_model():
+    from transformers import AutoImageProcessor, AutoModel
+
     if config.DINO_MODEL_PATH.exists():
         print(f"Loading DINOv2 from local path: {config.DINO_MODEL_PATH}")
         try:
@@ -32,46 +35,115 @@ def load_model():
     )
     return model, processor
 
-model, processor = load_model()
-device = "cuda" if torch.cuda.is_available() else "cpu"
-model = model.to(device)
-model.eval()
+_model = None
+_processor = None
+_runner = None
+_normalizer = None
+device = None
+_load_lock = threading.Lock()
+
+def get_model():
+    # Loaded on first use; importing this module stays cheap.
+    global _model, _processor, device
+    if _model is None:
+        with _load_lock:
+            if _model is None:
+                import torch
+                model, processor = load_model()
+                device = "cuda" if torch.cuda.is_available() else "cpu"
+                model = model.to(device)
+                model.eval()
+                _processor = processor
+                _model = model
+    return _model, _processor
+
+def get_runner():
+    # Encoder + CLS/register token drop + GeM on the configured INFERENCE_BACKEND
+    global _runner
+    if _runner is None:
+        model, _ = get_model()
+        normalizer = get_normalizer()
+        with _load_lock:
+            if _runner is None:
+                from src.models.backends import VisionEmbedder, build_runner
+                _runner = build_runner("dino", VisionEmbedder(model, skip_tokens=5), device,
+                                       preprocess=lambda images: normalizer(pp.resize_batch(images)))
+    return _runner
+
+def get_normalizer():
+    # This model's mean/std, read from its HF processor, as a fused batched op
+    global _normalizer
+    if _normalizer is None:
+        _, processor = get_model()
+        with _load_lock:
+            if _normalizer is None:
+                _normalizer = pp.Normalizer(*pp.processor_stats(processor), device=device)
+    return _normalizer
+
+def is_loaded():
+    return _model is not None
+
+def warm_up():
+    get_runner()
+
+def embedding_dim():
+    return projection.output_dim("dino", config.DINO_DIM)
 
-dino_index = fi.create_flat_ip_index(config.DINO_DIM)
-image_paths = []
+def model_version():
+    # Feature-cache tag: changes whenever the same bytes would embed differently.
+    source = config.DINO_MODEL_PATH if config.DINO_MODEL_PATH.exists() else config.DINO_ONLINE_ID
+    return f"{os.path.basename(str(source))}|{pp.VERSION}|{config.INFERENCE_BACKEND}|{projection.version('dino')}"
+
+def preprocess(images):
+    # Resized once to 224x224 (an ImageContext shares that copy with the other
+    # model), then normalized in one batched op into a reused buffer
+    return normalize(pp.resize_batch(images))
+
+def normalize(batch):
+    return get_normalizer()(batch)
+
+def embed_pixels(pixel_values):
+    emb = get_runner()(pixel_values)
+    fi.normalize_l2(emb)
+    # PCA trained by scripts/migrate_indices.py --pca, if any; re-normalised inside
+    emb = projection.project("dino", emb)
+
+    return emb
 
 def get_dino_embedding(image_path):
     try:
-        img = Image.open(image_path).convert("RGB")
-        inputs = processor(
-            images=img,
-            return_tensors="pt",
-            do_center_crop=False,
-            do_resize=True,
-            size={"height": 224, "width": 224}
-        )
-        inputs = {k: v.to(device) for k, v in inputs.items()}
-
-        with torch.no_grad():
-            outputs = model(**inputs)
-
-        last_hidden_states = outputs.last_hidden_state
-        patch_tokens = last_hidden_states[:, 5:, :]
-        
-        pooled_embedding = gem(patch_tokens)
-        
-        emb = pooled_embedding.detach().cpu().numpy().astype('float32')
-        fi.normalize_l2(emb)
-        
-        return emb
+        return embed_pixels(preprocess(image_path))
 
     except Exception as e:
-        print(f"Error processing DINO embedding for {image_path}: {e}")
+        print(f"Error processing DINO embedding for {getattr(image_path, 'path', image_path)}: {e}")
         return None
 
-def add_image_to_faiss(image_path):
-    emb = get_dino_embedding(image_path)
-    if emb is not None:
-        dino_index.add(emb)
-        image_paths.append(image_path)
-        print(f"Added {image_path} to dino index.")
\ No newline at end of file
+def embed_dino_pixels(pixel_values, batch_size=None):
+    batch_size = resolve_batch_size(batch_size, get_model()[0].config)
+    chunks = run_chunked(embed_pixels, pixel_values, batch_size)
+    if not chunks:
+        return np.zeros((0, embedding_dim()), dtype='float32')
+    return np.concatenate(chunks, axis=0)
+
+def get_dino_embeddings(images, batch_size=None):
+    """
+    Embeds a list of image paths / PIL images / ImageContexts.
+    Returns an (N, DINO_DIM) array; rows of images that failed to load are all zero.
+    Images are decoded one chunk at a time, so memory stays bounded by the batch size.
+    """
+    batch_size = resolve_batch_size(batch_size, get_model()[0].config)
+    embeddings = np.zeros((len(images), embedding_dim()), dtype='float32')
+
+    def forward(chunk):
+        rows, imgs = [], []
+        for row, image in chunk:
+            try:
+                imgs.append(pp.resize_image(image))
+                rows.append(row)
+            except Exception as e:
+                print(f"Error loading {getattr(image, 'path', image)} for DINO: {e}")
+        if imgs:
+            embeddings[rows] = embed_pixels(normalize(np.stack(imgs)))
+
+    run_chunked(forward, list(enumerate(images)), batch_size)
+    return embeddings
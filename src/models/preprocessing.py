@@ -0,0 +1,81 @@
+import threading
+
+import numpy as np
+from PIL import Image
+
+INPUT_SIZE = 224
+VERSION = f"fused{INPUT_SIZE}"
+
+
+def resize_image(image, size=INPUT_SIZE):
+    """
+    One decoded image -> (size, size, 3) uint8, resized once with bicubic
+    and no crop (what both HF processors were configured to do). Accepts
+    paths, PIL images, ImageContexts (whose resized copy is shared by CLIP
+    and DINO) and arrays already at the input size.
+    """
+    if hasattr(image, 'model_input'):
+        return image.model_input
+    if isinstance(image, np.ndarray) and image.shape == (size, size, 3):
+        return image
+    from src.utils.image_context import load_rgb
+    rgb = image if isinstance(image, Image.Image) and image.mode == "RGB" else load_rgb(image, (size, size))
+    if rgb.size != (size, size):
+        rgb = rgb.resize((size, size), Image.BICUBIC)
+    return np.asarray(rgb, dtype=np.uint8)
+
+
+def resize_batch(images, size=INPUT_SIZE):
+    if not isinstance(images, (list, tuple)):
+        images = [images]
+    batch = np.empty((len(images), size, size, 3), dtype=np.uint8)
+    for row, image in enumerate(images):
+        batch[row] = resize_image(image, size)
+    return batch
+
+
+class Normalizer:
+    """
+    Per-model rescale + mean/std as one fused multiply-add on a batch of
+    uint8 HWC images, written into an NCHW float32 buffer that is reused
+    across calls (one per thread, grown on demand). On CUDA the uint8 batch
+    is uploaded first and normalized on the device. The returned tensor is
+    overwritten by the next call on the same thread.
+    """
+
+    def __init__(self, mean, std, device="cpu"):
+        import torch
+
+        mean = np.asarray(mean, dtype=np.float32).reshape(1, 3, 1, 1)
+        std = np.asarray(std, dtype=np.float32).reshape(1, 3, 1, 1)
+        self.device = device
+        self.scale = torch.from_numpy(1.0 / (255.0 * std)).to(device)
+        self.shift = torch.from_numpy(-mean / std).to(device)
+        self.local = threading.local()
+
+    def buffer(self, n, size):
+        import torch
+
+        buf = getattr(self.local, "buffer", None)
+        if buf is None or buf.shape[0] < n or buf.shape[2] != size:
+            buf = torch.empty((n, 3, size, size), dtype=torch.float32, device=self.device)
+            self.local.buffer = buf
+        return buf[:n]
+
+    def __call__(self, batch):
+        import torch
+
+        batch = np.ascontiguousarray(batch, dtype=np.uint8)
+        if batch.ndim == 3:
+            batch = batch[None]
+        pixels = torch.from_numpy(batch).to(self.device, non_blocking=True).permute(0, 3, 1, 2)
+        out = self.buffer(len(batch), batch.shape[1])
+        out.copy_(pixels)
+        out.mul_(self.scale).add_(self.shift)
+        return out
+
+
+def processor_stats(processor):
+    # mean/std from a loaded HF image processor (CLIPProcessor wraps one).
+    image_processor = getattr(processor, "image_processor", processor)
+    return image_processor.image_mean, image_processor.image_std
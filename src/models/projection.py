@@ -0,0 +1,145 @@
+import json
+import os
+import threading
+
+import faiss
+import numpy as np
+
+from src import config
+import src.utils.faiss_ops as fi
+
+CALIBRATION_GRID = np.linspace(-1.0, 1.0, 201)
+CALIBRATION_POOL = 20000
+CALIBRATION_QUERIES = 2000
+CALIBRATION_NEIGHBOURS = 50
+
+_projections = {}
+_lock = threading.Lock()
+
+
+class Projection:
+    """
+    Trained PCA (optionally whitened) that maps L2-normalised embeddings to a
+    smaller space, plus the cosine calibration between the two spaces.
+    """
+
+    def __init__(self, matrix, reference_grid, projected_grid, whiten=False):
+        self.matrix = matrix
+        self.whiten = whiten
+        self.reference_grid = np.asarray(reference_grid, dtype=np.float64)
+        self.projected_grid = np.asarray(projected_grid, dtype=np.float64)
+
+    @property
+    def d_in(self):
+        return self.matrix.d_in
+
+    @property
+    def d_out(self):
+        return self.matrix.d_out
+
+    def apply(self, vectors):
+        projected = self.matrix.apply(np.ascontiguousarray(vectors, dtype=np.float32))
+        fi.normalize_l2(projected)
+        return projected
+
+    def to_reference_scale(self, score):
+        # Projected cosine -> the cosine the full 768-d embeddings would have,
+        # so DINO_THRESHOLD / CLIP_THRESHOLD keep their meaning.
+        return float(np.interp(score, self.projected_grid, self.reference_grid))
+
+    def save(self, name):
+        matrix_path, meta_path = projection_paths(name)
+        faiss.write_VectorTransform(self.matrix, matrix_path)
+        with open(meta_path, "w") as f:
+            json.dump({"d_in": self.d_in, "d_out": self.d_out, "whiten": self.whiten,
+                       "reference_grid": self.reference_grid.tolist(),
+                       "projected_grid": self.projected_grid.tolist()}, f)
+        with _lock:
+            _projections[name] = self
+        print(f"Saved {name} projection: {matrix_path}")
+
+
+def projection_paths(name):
+    base = os.path.join(str(config.INDEX_DIR), f"{name}_pca")
+    return base + ".vt", base + ".json"
+
+
+def load_projection(name):
+    matrix_path, meta_path = projection_paths(name)
+    if not os.path.exists(matrix_path) or not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    matrix = faiss.downcast_VectorTransform(faiss.read_VectorTransform(matrix_path))
+    return Projection(matrix, meta["reference_grid"], meta["projected_grid"], meta.get("whiten", False))
+
+
+def get_projection(name):
+    if name not in _projections:
+        with _lock:
+            if name not in _projections:
+                _projections[name] = load_projection(name)
+    return _projections[name]
+
+
+def output_dim(name, default):
+    projection = get_projection(name)
+    return projection.d_out if projection is not None else default
+
+
+def project(name, vectors):
+    projection = get_projection(name)
+    return vectors if projection is None else projection.apply(vectors)
+
+
+def to_reference_scale(name, score):
+    projection = get_projection(name)
+    return score if projection is None else projection.to_reference_scale(score)
+
+
+def version(name):
+    # Identifies the projection in cache keys; retraining changes it.
+    matrix_path, _ = projection_paths(name)
+    if get_projection(name) is None or not os.path.exists(matrix_path):
+        return "none"
+    return f"pca{get_projection(name).d_out}-{int(os.path.getmtime(matrix_path))}"
+
+
+def calibrate(vectors, projected, seed=1234):
+    # Pair each sampled query with its nearest neighbours (the 0.2-0.6 band the
+    # pipeline decides on) and map cosine quantiles between the two spaces.
+    rng = np.random.default_rng(seed)
+    if len(vectors) > CALIBRATION_POOL:
+        pool = rng.choice(len(vectors), CALIBRATION_POOL, replace=False)
+        vectors, projected = vectors[pool], projected[pool]
+    queries = rng.choice(len(vectors), min(CALIBRATION_QUERIES, len(vectors)), replace=False)
+    k = min(CALIBRATION_NEIGHBOURS + 1, len(vectors))
+
+    sims = vectors[queries] @ vectors.T
+    neighbours = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    reference = np.take_along_axis(sims, neighbours, axis=1)
+    reduced = np.einsum('qd,qkd->qk', projected[queries], projected[neighbours])
+
+    not_self = neighbours != queries[:, None]
+    reference, reduced = reference[not_self], reduced[not_self]
+
+    quantiles = np.searchsorted(np.sort(reference), CALIBRATION_GRID) / max(len(reference), 1)
+    projected_grid = np.quantile(reduced, np.clip(quantiles, 0.0, 1.0))
+    # np.interp needs increasing x; nudge ties apart
+    projected_grid = np.maximum.accumulate(projected_grid + np.arange(len(projected_grid)) * 1e-9)
+    return CALIBRATION_GRID, projected_grid
+
+
+def train_projection(name, vectors, dim, whiten=False):
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    fi.normalize_l2(vectors)
+    eigen_power = -0.5 if whiten else 0.0
+    matrix = faiss.PCAMatrix(vectors.shape[1], dim, eigen_power)
+    print(f"Training {name} PCA {vectors.shape[1]} -> {dim}{' (whitened)' if whiten else ''} on {len(vectors)} vectors...")
+    matrix.train(vectors)
+
+    projected = matrix.apply(vectors)
+    fi.normalize_l2(projected)
+    reference_grid, projected_grid = calibrate(vectors, projected)
+
+    return Projection(matrix, reference_grid, projected_grid, whiten)
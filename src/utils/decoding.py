@@ -0,0 +1,69 @@
+import io
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from src import config
+
+# PIL's own guard (warning above the limit, error above twice it) for any
+# Image.open that does not come through here.
+Image.MAX_IMAGE_PIXELS = config.MAX_IMAGE_PIXELS
+
+CV2_REDUCED = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+def check_pixels(size, name="image"):
+    width, height = size
+    if width * height > config.MAX_IMAGE_PIXELS:
+        raise ValueError(f"{name} is {width}x{height} pixels, above MAX_IMAGE_PIXELS ({config.MAX_IMAGE_PIXELS})")
+
+
+def as_stream(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    return source
+
+
+def open_image(source, min_size=None):
+    """
+    Opens a path, file object or bytes without decoding it yet, refusing
+    images above MAX_IMAGE_PIXELS. With min_size (w, h) JPEGs are set up to
+    decode at the smallest 1/2, 1/4 or 1/8 scale still covering it, which
+    skips most of the IDCT work; other formats decode at full size. Returns
+    (image, original (w, h)).
+    """
+    img = Image.open(as_stream(source))
+    original_size = img.size
+    check_pixels(original_size, getattr(img, "filename", None) or "image")
+    if min_size is not None and img.format == "JPEG":
+        img.draft("RGB", tuple(min_size))
+    return img, original_size
+
+
+def decode_rgb(source, min_size=None):
+    img, original_size = open_image(source, min_size)
+    with img:
+        return img.convert("RGB"), original_size
+
+
+def reduced_flag(size, min_size):
+    # Largest OpenCV reduction that keeps both sides at or above min_size.
+    width, height = size
+    for factor, flag in CV2_REDUCED:
+        if width // factor >= min_size[0] and height // factor >= min_size[1]:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def imread_reduced(path, min_size):
+    # cv2.imread at the reduced scale the caller's resize target allows; the
+    # header is read first (through PIL) for the size and the pixel guard.
+    try:
+        with Image.open(path) as img:
+            size = img.size
+    except Exception:
+        return cv2.imread(path)
+    check_pixels(size, path)
+    return cv2.imread(path, reduced_flag(size, min_size))
+
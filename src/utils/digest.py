@@ -0,0 +1,15 @@
+import hashlib
+
+CHUNK_SIZE = 1 << 20
+
+
+def bytes_digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def file_digest(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
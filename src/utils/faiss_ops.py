@@ -1,6 +1,10 @@
+import os
+import threading
 import numpy as np
 import faiss
 
+_direct_map_lock = threading.Lock()
+
 def hash_to_faiss_vector(hash_input):
     if hasattr(hash_input, 'hash'):
         packed_arr = np.packbits(hash_input.hash.flatten())
@@ -17,21 +21,159 @@ def hash_to_faiss_vector(hash_input):
 def create_binary_index(dimension):
     return faiss.IndexBinaryFlat(dimension)
 
+def create_binary_multihash_index(dimension, nhash):
+    # Multi-index hashing: the code is split into nhash disjoint substrings, each
+    # with its own hash table. By pigeonhole, any code within Hamming distance
+    # nhash - 1 shares at least one substring exactly, so lookups stay exact
+    # for radii below nhash while touching only matching buckets.
+    return faiss.IndexBinaryMultiHash(dimension, nhash, dimension // nhash)
+
 def create_flat_ip_index(dimension):
     return faiss.IndexFlatIP(dimension)
 
-def read_index(filepath, is_binary=False):
-    if is_binary:
-        return faiss.read_index_binary(filepath)
-    else:
-        return faiss.read_index(filepath)
+def read_index(filepath, is_binary=False, mmap=False):
+    # IO_FLAG_MMAP_IFC maps the stored codes of any index type (flat, SQ, PQ,
+    # HNSW storage, IVF lists, binary); faiss builds without it only have
+    # IO_FLAG_MMAP, which maps IVF inverted lists and reads everything else into RAM.
+    reader = faiss.read_index_binary if is_binary else faiss.read_index
+    if mmap:
+        flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+        try:
+            return reader(filepath, flag | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError as e:
+            print(f"Cannot memory-map {filepath} ({e}), loading into RAM")
+    return reader(filepath)
+
+def can_mmap(index):
+    # Whether read_index(..., mmap=True) maps this index instead of copying it.
+    if hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+        return True
+    return isinstance(unwrap_index(index), (faiss.IndexIVF, faiss.IndexBinaryIVF))
 
 def write_index(index, filepath, is_binary=False):
+    # Write next to the target and rename, so readers that memory-mapped the
+    # previous file keep a valid mapping and a crash never leaves a torn shard.
+    tmp_path = f"{filepath}.tmp"
     if is_binary:
-        faiss.write_index_binary(index, filepath)
+        faiss.write_index_binary(index, tmp_path)
     else:
-        faiss.write_index(index, filepath)
+        faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, filepath)
 
 def normalize_l2(vector):
     faiss.normalize_L2(vector)
 
+TRAINED_INDEX_TYPES = ("ivf", "ivfpq", "sq8", "pq")
+
+def create_ivf_index(dimension, nlist):
+    return faiss.index_factory(dimension, f"IVF{nlist},Flat", faiss.METRIC_INNER_PRODUCT)
+
+def create_ivfpq_index(dimension, nlist, m, nbits=8):
+    return faiss.index_factory(dimension, f"IVF{nlist},PQ{m}x{nbits}", faiss.METRIC_INNER_PRODUCT)
+
+def create_sq8_index(dimension):
+    return faiss.index_factory(dimension, "SQ8", faiss.METRIC_INNER_PRODUCT)
+
+def create_fp16_index(dimension):
+    return faiss.index_factory(dimension, "SQfp16", faiss.METRIC_INNER_PRODUCT)
+
+def fit_pq_m(dimension, m):
+    # PQ splits a vector into m equal sub-vectors, so m must divide the
+    # dimension (e.g. PQ_M = 96 does not divide a 256-d PCA output).
+    return max(k for k in range(1, min(m, dimension) + 1) if dimension % k == 0)
+
+def create_pq_index(dimension, m, nbits=8):
+    return faiss.index_factory(dimension, f"PQ{m}x{nbits}", faiss.METRIC_INNER_PRODUCT)
+
+def create_hnsw_index(dimension, m, ef_construction):
+    index = faiss.index_factory(dimension, f"HNSW{m},Flat", faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = ef_construction
+    return index
+
+def clone_index(index):
+    return faiss.clone_index(index)
+
+def wrap_with_ids(index):
+    if isinstance(index, faiss.IndexBinary):
+        return faiss.IndexBinaryIDMap(index)
+    return faiss.IndexIDMap(index)
+
+def has_ids(index):
+    return isinstance(index, (faiss.IndexIDMap, faiss.IndexBinaryIDMap))
+
+def unwrap_index(index):
+    if isinstance(index, faiss.IndexBinary):
+        while isinstance(index, faiss.IndexBinaryIDMap):
+            index = faiss.downcast_IndexBinary(index.index)
+        return index
+    index = faiss.downcast_index(index)
+    while isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    return index
+
+def get_ids(index):
+    if has_ids(index):
+        return faiss.vector_to_array(index.id_map).astype('int64')
+    return np.arange(index.ntotal, dtype='int64')
+
+def is_flat_index(index):
+    return isinstance(unwrap_index(index), faiss.IndexFlat)
+
+def stores_full_vectors(index):
+    # True when reconstruct() returns the float32 vectors that were added.
+    base = unwrap_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        base = faiss.downcast_index(base.storage)
+    return isinstance(base, (faiss.IndexFlat, faiss.IndexIVFFlat))
+
+def is_ann_index(index):
+    base = unwrap_index(index)
+    return isinstance(base, (faiss.IndexIVF, faiss.IndexHNSW))
+
+def make_search_params(index, nprobe=None, ef_search=None):
+    base = unwrap_index(index)
+    if nprobe is not None and isinstance(base, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(nprobe=nprobe)
+    if ef_search is not None and isinstance(base, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=ef_search)
+    return None
+
+def make_id_selector(ids):
+    ids = np.ascontiguousarray(ids, dtype='int64')
+    return faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids))
+
+def reconstruct_all(index):
+    # Rows come back in insertion order, which is also the order of get_ids(index).
+    base = unwrap_index(index)
+    if isinstance(base, faiss.IndexBinary):
+        storage = getattr(base, "storage", None)
+        if storage is not None:
+            base = storage
+        return base.reconstruct_n(0, base.ntotal)
+    if isinstance(base, faiss.IndexIVF):
+        base.make_direct_map()
+    return base.reconstruct_n(0, base.ntotal)
+
+def reconstruct_ids(index, ids):
+    # Rows of an IDMap shard whose catalog ids are in `ids`: (their ids, the
+    # stored vectors as the index decodes them, e.g. PQ approximations).
+    stored = get_ids(index)
+    rows = np.flatnonzero(np.isin(stored, ids))
+    base = unwrap_index(index)
+    if not len(rows):
+        return stored[rows], np.zeros((0, base.d), dtype='float32')
+    if isinstance(base, faiss.IndexIVF):
+        # Built once per shard and kept up to date by later adds.
+        with _direct_map_lock:
+            if base.direct_map.type == faiss.DirectMap.NoMap:
+                base.make_direct_map()
+    return stored[rows], base.reconstruct_batch(rows.astype('int64'))
+
+def sample_vectors(index, n, seed=1234):
+    base = unwrap_index(index)
+    if n >= base.ntotal:
+        return reconstruct_all(base)
+    if isinstance(base, faiss.IndexIVF):
+        base.make_direct_map()
+    ids = np.sort(np.random.default_rng(seed).choice(base.ntotal, n, replace=False)).astype('int64')
+    return base.reconstruct_batch(ids)
@@ -0,0 +1,116 @@
+import numpy as np
+from PIL import Image
+
+# Bump when the hash computation changes so cached hashes are not reused.
+HASH_VERSION = "fast_hash-3"
+HASH_SIZE = 8
+PHASH_SIZE = HASH_SIZE * 4
+
+AUGMENTATIONS = (
+    "original",
+    "rotate_90",
+    "rotate_180",
+    "rotate_270",
+    "flip_horizontal",
+    "flip_vertical",
+    "flip_both",
+)
+
+
+def _dct_rows(n, rows):
+    # First `rows` basis rows of scipy.fftpack.dct (type II, unnormalised),
+    # which is what imagehash.phash applies along each axis.
+    k = np.arange(rows)[:, None]
+    i = np.arange(n)[None, :]
+    return 2.0 * np.cos(np.pi * k * (2 * i + 1) / (2 * n))
+
+
+DCT_LOW = _dct_rows(PHASH_SIZE, HASH_SIZE)
+# (-1)^k: mirroring a signal negates its odd DCT coefficients
+SIGN = (-1.0) ** np.arange(HASH_SIZE)
+
+
+def whash_scale(size):
+    natural_scale = 2 ** int(np.log2(min(size)))
+    return max(natural_scale, HASH_SIZE)
+
+
+def hash_inputs(image):
+    """
+    Reduces one image to what both hashes need: the 32x32 grayscale used by
+    pHash and the 8x8 block means that wHash's Haar LL band thresholds on.
+    """
+    gray = image if image.mode == "L" else image.convert("L")
+    small = np.asarray(gray.resize((PHASH_SIZE, PHASH_SIZE), Image.LANCZOS), dtype=np.float64)
+
+    scale = whash_scale(gray.size)
+    large = np.asarray(gray.resize((scale, scale), Image.LANCZOS), dtype=np.float64)
+    step = scale // HASH_SIZE
+    blocks = large.reshape(HASH_SIZE, step, HASH_SIZE, step).mean(axis=(1, 3))
+    return small, blocks
+
+
+def dct_variants(low):
+    # low: (N, 8, 8) low-frequency DCT block, rows = vertical frequency.
+    # Flips are sign patterns and 90 degree turns add a transpose, in the
+    # order of AUGMENTATIONS (PIL rotate_90 is clockwise).
+    row_sign = SIGN[:, None]
+    col_sign = SIGN[None, :]
+    t = np.swapaxes(low, -1, -2)
+    return np.stack([
+        low,
+        t * col_sign,
+        low * row_sign * col_sign,
+        t * row_sign,
+        low * col_sign,
+        low * row_sign,
+        low * row_sign * col_sign,
+    ], axis=1)
+
+
+def spatial_variants(blocks):
+    # blocks: (N, 8, 8) in image orientation; same order as dct_variants.
+    return np.stack([
+        blocks,
+        np.rot90(blocks, -1, axes=(1, 2)),
+        np.rot90(blocks, 2, axes=(1, 2)),
+        np.rot90(blocks, 1, axes=(1, 2)),
+        blocks[:, :, ::-1],
+        blocks[:, ::-1, :],
+        blocks[:, ::-1, ::-1],
+    ], axis=1)
+
+
+def threshold_median(values):
+    flat = values.reshape(values.shape[:-2] + (-1,))
+    median = np.median(flat, axis=-1)
+    return values > median[..., None, None]
+
+
+def hash_batch(smalls, blocks, augment=True):
+    """
+    smalls: (N, 32, 32), blocks: (N, 8, 8) stacked hash_inputs.
+    Returns pHash and wHash bit arrays of shape (N, V, 8, 8), where V is 7
+    with augment (AUGMENTATIONS order) and 1 without.
+    """
+    low = np.einsum('ij,njk,lk->nil', DCT_LOW, np.asarray(smalls, dtype=np.float64), DCT_LOW)
+    blocks = np.asarray(blocks, dtype=np.float64)
+    if augment:
+        low = dct_variants(low)
+        blocks = spatial_variants(blocks)
+    else:
+        low = low[:, None]
+        blocks = blocks[:, None]
+    return threshold_median(low), threshold_median(blocks)
+
+
+def pack_bits(bits):
+    # (..., 8, 8) bool -> (..., 8) uint8 in the byte order of hash_to_faiss_vector
+    return np.packbits(bits.reshape(bits.shape[:-2] + (-1,)), axis=-1)
+
+
+def hash_images(images, augment=True):
+    inputs = [hash_inputs(image) for image in images]
+    smalls = np.stack([small for small, _ in inputs])
+    blocks = np.stack([block for _, block in inputs])
+    return hash_batch(smalls, blocks, augment=augment)
@@ -4,6 +4,24 @@ import imagehash
 import json
 import numpy as np
 
+from src import config
+from src.utils import fast_hash
+from src.utils.decoding import open_image
+
+
+def open_for_hashing(path, decoded=None):
+    # pHash/wHash only need ~32 px, so JPEGs decode at a reduced scale. Every
+    # entry point hashes this same decode, since a different JPEG scale moves
+    # a few hash bits. `decoded`, the same file already decoded for another
+    # stage, is reused when it came out at the same scale and mode.
+    if isinstance(path, Image.Image):
+        return path
+    img = open_image(path, (config.HASH_DECODE_SIZE, config.HASH_DECODE_SIZE))[0]
+    if decoded is not None and decoded.size == img.size and decoded.mode == img.mode:
+        img.close()
+        return decoded
+    return img
+
 def is_image(path):
     size=os.path.getsize(path)
     if size==0:
@@ -16,14 +34,13 @@ def is_image(path):
         return False
 
 def pw_hash(path) :
-    img=Image.open(path)
-    p_hash=imagehash.phash(img)
-    w_hash=imagehash.whash(img)
-    return p_hash,w_hash
+    img=hash_preprocessing(path)
+    p_bits,w_bits=fast_hash.hash_images([img], augment=False)
+    return imagehash.ImageHash(p_bits[0, 0]),imagehash.ImageHash(w_bits[0, 0])
 
 
 def hash_preprocessing(path):
-    img=Image.open(path)
+    img=open_for_hashing(path)
     img=ImageOps.exif_transpose(img)
 
     if img.mode in ('RGBA','LA'):
@@ -37,15 +54,7 @@ def hash_preprocessing(path):
 
 
 def alter_image(image_path):
-    img = Image.open(image_path)
-    img = ImageOps.exif_transpose(img)
-    
-    if img.mode in ('RGBA', 'LA'):
-        bg = Image.new("RGB", img.size, (255, 255, 255))
-        bg.paste(img, mask=img.split()[3])
-        img = bg
-    else:
-        img = img.convert('RGB')
+    img = hash_preprocessing(image_path)
     
     return {
         "original": img,
@@ -59,19 +68,37 @@ def alter_image(image_path):
 
 
 def get_augmented_hashes(image_path):
-    augmented_images = alter_image(image_path)
-    hashes = []
-    
-    for aug_name, img in augmented_images.items():
-        p_hash = imagehash.phash(img)
-        try:
-            w_hash = imagehash.whash(img)
-        except Exception:
-            w_hash = p_hash
-        
-        hashes.append((p_hash, w_hash, aug_name))
-    
-    return hashes
+    # All seven variants come from one grayscale downscale: flips and 90 degree
+    # turns are sign changes/transposes of the DCT block (pHash) and
+    # permutations of the 8x8 block means (wHash), see fast_hash.
+    img = hash_preprocessing(image_path)
+    p_bits, w_bits = fast_hash.hash_images([img])
+    return [
+        (imagehash.ImageHash(p_bits[0, i]), imagehash.ImageHash(w_bits[0, i]), aug_name)
+        for i, aug_name in enumerate(fast_hash.AUGMENTATIONS)
+    ]
+
+
+def get_original_hashes(image_path):
+    img = hash_preprocessing(image_path)
+    p_bits, w_bits = fast_hash.hash_images([img], augment=False)
+    return [(imagehash.ImageHash(p_bits[0, 0]), imagehash.ImageHash(w_bits[0, 0]), "original")]
+
+
+def get_index_hashes(image_path, mode="index"):
+    # "index": store all seven augmentations so a plain lookup is rotation/flip invariant.
+    # "query": store only the original; the query side searches its own seven variants instead.
+    if mode == "query":
+        return get_original_hashes(image_path)
+    return get_augmented_hashes(image_path)
+
+
+def get_index_hash_vectors(image_path, mode="index"):
+    # Same hashes as get_index_hashes, already packed as faiss binary rows:
+    # (V, 8) uint8 pHash and wHash arrays without the ImageHash/hex round trip.
+    img = hash_preprocessing(image_path)
+    p_bits, w_bits = fast_hash.hash_images([img], augment=mode != "query")
+    return fast_hash.pack_bits(p_bits[0]), fast_hash.pack_bits(w_bits[0])
 
 
 # if __name__ == "__main__":
@@ -0,0 +1,231 @@
+import imagehash
+import numpy as np
+from PIL import Image
+
+from src import config
+from src.core.feature_cache import get_feature_cache
+from src.utils import hasher as fph
+from src.utils.digest import bytes_digest
+from src.utils.fast_hash import AUGMENTATIONS, HASH_VERSION
+from src.models.preprocessing import INPUT_SIZE, resize_image
+from src.utils.decoding import decode_rgb
+from src.utils.verification import (TARGET_SIZE, preprocess_image, count_features,
+                                    extract_features, extract_query_features)
+
+ORB_VERSION = "orb-2"
+# Largest input any stage resizes to (ORB 500x500, models 224x224): JPEGs
+# decode at the smallest DCT scale that still covers it.
+DECODE_SIZE = (max(TARGET_SIZE[0], INPUT_SIZE), max(TARGET_SIZE[1], INPUT_SIZE))
+
+
+def load_rgb(image, min_size=None):
+    if hasattr(image, 'rgb'):
+        return image.rgb
+    if isinstance(image, Image.Image):
+        return image if image.mode == "RGB" else image.convert("RGB")
+    return decode_rgb(image, min_size)[0]
+
+
+def pack_hash(image_hash):
+    return np.packbits(image_hash.hash.flatten())
+
+
+def unpack_hash(row):
+    return imagehash.ImageHash(np.unpackbits(row).reshape(8, 8).astype(bool))
+
+
+class ImageContext:
+    """
+    Per-query view of one image file.
+    The file is read and decoded once; every pipeline stage reads the cached
+    RGB image, the ORB/histogram arrays, the pHash/wHash results and the
+    CLIP/DINO embeddings from here. Features are also looked up in the
+    content-addressed feature cache by the digest of the file bytes, so a
+    repeated file costs one digest.
+    """
+
+    def __init__(self, image_path):
+        self.path = str(image_path)
+        self._data = None
+        self._digest = None
+        self._rgb = None
+        self._size = None
+        self._hash_image = None
+        self._model_input = None
+        self._cv_data = None
+        self._hashes = None
+        self._augmented_hashes = None
+        self._feature_count = None
+        self._embeddings = {}
+        self._verification_query = None
+        # Nearest neighbours per dense index, left by the pipeline's DINO/CLIP checks
+        self.candidates = {}
+
+    @property
+    def data(self):
+        if self._data is None:
+            with open(self.path, 'rb') as f:
+                self._data = f.read()
+        return self._data
+
+    @property
+    def digest(self):
+        if self._digest is None:
+            self._digest = bytes_digest(self.data)
+        return self._digest
+
+    def cached(self, kind, version, compute):
+        cache = get_feature_cache()
+        if cache is not None:
+            value = cache.get(self.digest, kind, version)
+            if value is not None:
+                return value
+        value = compute()
+        if cache is not None and value is not None:
+            cache.put(self.digest, kind, value, version)
+        return value
+
+    @property
+    def rgb(self):
+        # Reduced-resolution decode (see DECODE_SIZE); size keeps the original dimensions.
+        if self._rgb is None:
+            self._rgb, self._size = decode_rgb(self.data, DECODE_SIZE)
+        return self._rgb
+
+    @property
+    def size(self):
+        if self._size is None:
+            self.rgb
+        return self._size
+
+    @property
+    def hash_image(self):
+        # The HASH_DECODE_SIZE decode every entry point hashes (see fph.open_for_hashing)
+        if self._hash_image is None:
+            self._hash_image = fph.open_for_hashing(self.data, self._rgb)
+        return self._hash_image
+
+    @property
+    def model_input(self):
+        # 224x224 uint8 RGB shared by the CLIP and DINO preprocessing
+        if self._model_input is None:
+            self._model_input = resize_image(self.rgb)
+        return self._model_input
+
+    @property
+    def bgr(self):
+        return np.ascontiguousarray(np.asarray(self.rgb)[:, :, ::-1])
+
+    @property
+    def cv_data(self):
+        if self._cv_data is None:
+            self._cv_data = preprocess_image(self.bgr)
+        return self._cv_data
+
+    @property
+    def gray(self):
+        return self.cv_data[1]
+
+    @property
+    def hashes(self):
+        if self._hashes is None:
+            packed = self.cached("hashes", HASH_VERSION,
+                                 lambda: np.stack([pack_hash(h) for h in fph.pw_hash(self.hash_image)]))
+            self._hashes = tuple(unpack_hash(row) for row in packed)
+        return self._hashes
+
+    @property
+    def augmented_hashes(self):
+        if self._augmented_hashes is None:
+            def compute():
+                hashes = fph.get_augmented_hashes(self.hash_image)
+                return np.stack([[pack_hash(p), pack_hash(w)] for p, w, _ in hashes])
+
+            packed = self.cached("augmented_hashes", HASH_VERSION, compute)
+            self._augmented_hashes = [
+                (unpack_hash(p), unpack_hash(w), name) for (p, w), name in zip(packed, AUGMENTATIONS)
+            ]
+        return self._augmented_hashes
+
+    def index_hash_vectors(self, mode=None):
+        mode = mode or config.HASH_AUGMENT_MODE
+        packed = self.cached(f"index_hashes_{mode}", HASH_VERSION,
+                             lambda: np.stack(fph.get_index_hash_vectors(self.hash_image, mode)))
+        return packed[0], packed[1]
+
+    @property
+    def phash(self):
+        return self.hashes[0]
+
+    @property
+    def whash(self):
+        return self.hashes[1]
+
+    @property
+    def feature_count(self):
+        if self._feature_count is None:
+            count = self.cached("orb_count", ORB_VERSION,
+                                lambda: np.array([count_features(self.gray)], dtype=np.int64))
+            self._feature_count = int(count[0])
+        return self._feature_count
+
+    @property
+    def verification_features(self):
+        return extract_features(self.cv_data)
+
+    @property
+    def verification_query(self):
+        if self._verification_query is None:
+            self._verification_query = extract_query_features(self.cv_data)
+        return self._verification_query
+
+    def embedding(self, engine, kind, embed):
+        if kind not in self._embeddings:
+            self._embeddings[kind] = self.cached(kind, engine.model_version(), lambda: embed(self))
+        return self._embeddings[kind]
+
+    @property
+    def dino_embedding(self):
+        from src.models import dino_engine as dt
+        return self.embedding(dt, "dino", dt.get_dino_embedding)
+
+    @property
+    def clip_embedding(self):
+        from src.models import clip_engine as ct
+        return self.embedding(ct, "clip", ct.get_clip_embedding)
+
+
+def embed_contexts(contexts, engine, kind, embed_many):
+    """
+    Fills the `kind` embedding of many contexts at once: cached ones come from
+    the feature cache, the misses go through one batched embed_many call
+    (which returns zero rows for images that failed). Returns one (1, d)
+    array or None per context.
+    """
+    cache = get_feature_cache()
+    version = engine.model_version()
+    missing = []
+    for ctx in contexts:
+        if kind in ctx._embeddings:
+            continue
+        value = cache.get(ctx.digest, kind, version) if cache is not None else None
+        if value is None:
+            missing.append(ctx)
+        else:
+            ctx._embeddings[kind] = value
+
+    if missing:
+        for ctx, emb in zip(missing, embed_many(missing)):
+            if not np.any(emb):
+                ctx._embeddings[kind] = None
+                continue
+            ctx._embeddings[kind] = emb.reshape(1, -1)
+            if cache is not None:
+                cache.put(ctx.digest, kind, ctx._embeddings[kind], version)
+    return [ctx._embeddings[kind] for ctx in contexts]
+
+
+def as_context(image):
+    if isinstance(image, ImageContext):
+        return image
+    return ImageContext(image)
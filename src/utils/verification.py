@@ -1,11 +1,18 @@
+import threading
+
 import cv2
 import numpy as np
 import matplotlib.pyplot as plt
 
+from src.utils.decoding import imread_reduced
+
 TARGET_SIZE = (500, 500)
 
 ORB_FEATURES = 500      
 MATCH_THRESHOLD = 50    
+MATCH_RATIO = 0.75      # Lowe's ratio test on the two nearest descriptors
+RANSAC_REPROJ = 5.0     # homography inlier tolerance, pixels at TARGET_SIZE
+MIN_INLIERS = 10        # fewer inliers than this is a chance fit
 
 DEFAULT_WEIGHTS = {
     'structure': 0.42,  
@@ -13,9 +20,27 @@ DEFAULT_WEIGHTS = {
     'color':     0.15  
 }
 
+# Orientations hist_match tries: (name, cv2.flip code), None = unchanged
+FLIPS = (
+    ("Original", None),
+    ("Flip Horizontal", 1),
+    ("Flip Vertical", 0),
+    ("Double Flip", -1)
+)
+
+_local = threading.local()
+
 print(" Configuration Loaded.")
 # print(f"   Weights: {WEIGHTS}") # Removed print to avoid clutter
 
+def get_orb():
+    # One detector per thread instead of one per call
+    orb = getattr(_local, "orb", None)
+    if orb is None:
+        orb = cv2.ORB_create(nfeatures=ORB_FEATURES)
+        _local.orb = orb
+    return orb
+
 def preprocess_image(img):
     if img is None:
         return None
@@ -27,6 +52,16 @@ def preprocess_image(img):
 
     return blurred, gray, hsv
 
+def gray_histogram(gray):
+    hist = cv2.calcHist([gray], [0], None, [50], [0, 256])
+    cv2.normalize(hist, hist, 1, 0, cv2.NORM_L1)
+    return hist
+
+def hsv_histogram(hsv):
+    hist = cv2.calcHist([hsv], [0, 1], None, [30, 10], [0, 180, 0, 256])
+    cv2.normalize(hist, hist, 1, 0, cv2.NORM_L1)
+    return hist
+
 def get_histogram_score(img_a, img_b, channels, bins, ranges):
     hist_a = cv2.calcHist([img_a], channels, None, bins, ranges)
     hist_b = cv2.calcHist([img_b], channels, None, bins, ranges)
@@ -34,17 +69,34 @@ def get_histogram_score(img_a, img_b, channels, bins, ranges):
     cv2.normalize(hist_b, hist_b, 1, 0, cv2.NORM_L1)
     return cv2.compareHist(hist_a, hist_b, cv2.HISTCMP_INTERSECT)
 
+def orb_keypoints(gray):
+    # (N, 2) float32 keypoint positions and their (N, 32) uint8 descriptors
+    kp, des = get_orb().detectAndCompute(gray, None)
+    if des is None:
+        return np.zeros((0, 2), dtype=np.float32), np.zeros((0, 32), dtype=np.uint8)
+    return np.float32([k.pt for k in kp]), des
+
+def count_matches(points_a, des_a, points_b, des_b):
+    """
+    ORB matches that agree on one geometry: the ratio test keeps distinctive
+    nearest neighbours, then only the inliers of a RANSAC homography count.
+    Plain cross-checked matching gives unrelated photos 60-130 matches and
+    maxed out the spatial term; they now keep a handful at most.
+    """
+    if len(des_a) < 2 or len(des_b) < 2:
+        return 0
+    pairs = cv2.BFMatcher(cv2.NORM_HAMMING).knnMatch(des_a, des_b, k=2)
+    good = [p[0] for p in pairs if len(p) == 2 and p[0].distance < MATCH_RATIO * p[1].distance]
+    if len(good) < MIN_INLIERS:
+        return 0
+    src = points_a[[m.queryIdx for m in good]]
+    dst = points_b[[m.trainIdx for m in good]]
+    _, mask = cv2.findHomography(src, dst, cv2.RANSAC, RANSAC_REPROJ)
+    inliers = int(mask.sum()) if mask is not None else 0
+    return inliers if inliers >= MIN_INLIERS else 0
+
 def get_orb_score(gray_a, gray_b):
-    orb = cv2.ORB_create(nfeatures=ORB_FEATURES)
-    kp1, des1 = orb.detectAndCompute(gray_a, None)
-    kp2, des2 = orb.detectAndCompute(gray_b, None)
-    
-    raw_matches = 0
-    if des1 is not None and des2 is not None:
-        bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-        matches = bf.match(des1, des2)
-        raw_matches = len(matches)
-        
+    raw_matches = count_matches(*orb_keypoints(gray_a), *orb_keypoints(gray_b))
     return min(1.0, raw_matches / MATCH_THRESHOLD), raw_matches
 
 def compare_image_data(data_a, data_b, weights=None):
@@ -74,6 +126,67 @@ def compare_image_data(data_a, data_b, weights=None):
         }
     }
 
+def extract_features(data):
+    """
+    What compare_features needs from one preprocessed image: its ORB
+    keypoint positions and descriptors and the L1-normalised gray (50 bins)
+    and HSV (30x10) histograms. Small enough to precompute and store per
+    indexed image.
+    """
+    _, gray, hsv = data
+    points, descriptors = orb_keypoints(gray)
+    return {
+        'points': points,
+        'descriptors': descriptors,
+        'gray_hist': gray_histogram(gray),
+        'hsv_hist': hsv_histogram(hsv)
+    }
+
+def extract_query_features(data):
+    # Histograms do not change under flips, so only the ORB keypoints are
+    # recomputed for each orientation in FLIPS.
+    features = extract_features(data)
+    _, gray, _ = data
+    features['flips'] = [
+        (name,) + ((features['points'], features['descriptors']) if flip_code is None
+                   else orb_keypoints(cv2.flip(gray, flip_code)))
+        for name, flip_code in FLIPS
+    ]
+    return features
+
+def compare_features(query, candidate, weights=None):
+    """
+    Same score as compare_image_data, from extract_query_features /
+    extract_features output; the best orientation of the query wins.
+    """
+    if weights is None:
+        weights = DEFAULT_WEIGHTS
+
+    s_struct = cv2.compareHist(query['gray_hist'], candidate['gray_hist'], cv2.HISTCMP_INTERSECT)
+    s_color = cv2.compareHist(query['hsv_hist'], candidate['hsv_hist'], cv2.HISTCMP_INTERSECT)
+
+    best = None
+    for name, points, descriptors in query['flips']:
+        raw_count = count_matches(points, descriptors, candidate['points'], candidate['descriptors'])
+        s_spatial = min(1.0, raw_count / MATCH_THRESHOLD)
+        total = (
+            (s_struct  * weights['structure']) +
+            (s_spatial * weights['spatial']) +
+            (s_color   * weights['color'])
+        )
+        if best is None or total > best['total']:
+            best = {
+                'total': total,
+                'details': {
+                    'structure': s_struct,
+                    'spatial': s_spatial,
+                    'color': s_color,
+                    'raw_matches': raw_count,
+                    'orientation': name
+                }
+            }
+    return best
+
 def hist_match(image_path_a, image_path_b, weights=None):
     """
     Main entry point for histogram matching.
@@ -81,53 +194,29 @@ def hist_match(image_path_a, image_path_b, weights=None):
     Checks: Original, Flip Horizontal, Flip Vertical, Double Flip.
     Returns: (score, details_dict)
     """
-    img_a_raw = cv2.imread(image_path_a)
-    img_b_raw = cv2.imread(image_path_b)
+    img_a_raw = imread_reduced(image_path_a, TARGET_SIZE)
+    img_b_raw = imread_reduced(image_path_b, TARGET_SIZE)
     
     if img_a_raw is None or img_b_raw is None:
         raise ValueError(f"Could not load one or both images: {image_path_a}, {image_path_b}")
 
-    data_a = preprocess_image(img_a_raw)
-    
-    best_score = -1.0
-    best_details = {}
-    best_orientation = "Original"
-
-    # Define transformations: (name, flip_code)
-    # flip_code: None=Original, 1=Horizontal, 0=Vertical, -1=Both (Double Flip)
-    transforms = [
-        ("Original", None),
-        ("Flip Horizontal", 1),
-        ("Flip Vertical", 0),
-        ("Double Flip", -1)
-    ]
+    # Flipping after the resize/blur is equivalent to flipping B's raw image.
+    result = compare_features(extract_query_features(preprocess_image(img_b_raw)),
+                              extract_features(preprocess_image(img_a_raw)), weights=weights)
+    return result['total'], result['details']
 
-    for name, flip_code in transforms:
-        if flip_code is None:
-            img_b_trans = img_b_raw
-        else:
-            img_b_trans = cv2.flip(img_b_raw, flip_code)
-            
-        data_b = preprocess_image(img_b_trans)
-        result = compare_image_data(data_a, data_b, weights=weights)
-        
-        if result['total'] > best_score:
-            best_score = result['total']
-            best_details = result['details']
-            best_orientation = name
-            
-    best_details['orientation'] = best_orientation
-    return best_score, best_details
+def count_features(gray):
+    kp = get_orb().detect(gray, None)
+    return len(kp)
 
 def get_feature_count(image_path):
-    img = cv2.imread(image_path)
+    # Decoded at the reduced scale that still covers the 500x500 resize
+    img = imread_reduced(image_path, TARGET_SIZE)
     if img is None:
         return 0
         
     _, gray, _ = preprocess_image(img)
-    orb = cv2.ORB_create(nfeatures=ORB_FEATURES)
-    kp = orb.detect(gray, None)
-    return len(kp)
+    return count_features(gray)
 
 if __name__ == "__main__":
     path_a = '3.png'
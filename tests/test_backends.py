@@ -0,0 +1,24 @@
+import torch
+
+from src import config
+from src.models import backends
+
+
+class TinyEncoder(torch.nn.Module):
+    # Stands in for a ViT: (N, 3, H, W) -> (N, tokens, dim) last hidden state.
+    def __init__(self):
+        super().__init__()
+        self.patch = torch.nn.Conv2d(3, 8, kernel_size=32, stride=32)
+
+    def forward(self, pixel_values, return_dict=False):
+        return (self.patch(pixel_values).flatten(2).transpose(1, 2),)
+
+
+def test_torchscript_is_traced_on_the_module_device(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "MODEL_DIR", tmp_path)
+    embedder = backends.VisionEmbedder(TinyEncoder(), skip_tokens=1)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    runner = backends.build_runner("tiny", embedder, device, backend="torchscript")
+    assert isinstance(runner.module, torch.jit.ScriptModule)
+    assert backends.export_path("tiny", "torchscript").exists()
@@ -0,0 +1,58 @@
+import numpy as np
+
+from src.core import bulk_indexer
+from src.core.bulk_indexer import BulkIndexer
+from src.core.catalog import ImageCatalog
+from src.core.index_manager import IndexShardManager
+from src.models import clip_engine as ct
+from src.models import dino_engine as dt
+
+
+def item(path, seed):
+    rng = np.random.default_rng(seed)
+    return {"path": path, "phash": rng.integers(0, 256, (2, 8), dtype=np.uint8),
+            "whash": rng.integers(0, 256, (2, 8), dtype=np.uint8),
+            "pixels": np.zeros((4, 4, 3), np.uint8), "features": None, "error": None,
+            "size": 1, "mtime_ns": 1, "digest": bytes([seed]), "dims": (4, 4)}
+
+
+def make_indexer(tmp_path, monkeypatch, dino_fails):
+    def fake_model(module, fails):
+        def embed(pixels, batch_size=None):
+            if fails:
+                raise RuntimeError("out of memory")
+            return np.ones((len(pixels), 8), np.float32)
+        monkeypatch.setattr(module, "model_version", lambda: "test")
+        monkeypatch.setattr(module, "preprocess", lambda imgs: imgs)
+        return embed
+
+    monkeypatch.setattr(bulk_indexer, "get_feature_cache", lambda: None)
+    monkeypatch.setattr(ct, "embed_clip_pixels", fake_model(ct, False))
+    monkeypatch.setattr(dt, "embed_dino_pixels", fake_model(dt, dino_fails))
+    catalog = ImageCatalog(tmp_path / "catalog.sqlite")
+    managers = {
+        "phash": IndexShardManager(str(tmp_path), "phash", 64, index_type="binary", catalog=catalog),
+        "whash": IndexShardManager(str(tmp_path), "whash", 64, index_type="binary", catalog=catalog),
+        "clip": IndexShardManager(str(tmp_path), "clip", 8, catalog=catalog),
+        "dino": IndexShardManager(str(tmp_path), "dino", 8, catalog=catalog),
+    }
+    return BulkIndexer(managers, catalog)
+
+
+def test_model_failure_rolls_back_hash_rows(tmp_path, monkeypatch):
+    indexer = make_indexer(tmp_path, monkeypatch, dino_fails=True)
+    indexer._index_batch([item("a.jpg", 1), item("b.jpg", 2)])
+
+    assert indexer.indexed_paths == [] and indexer.failed == 2
+    assert all(manager.active_index.ntotal == 0 for manager in indexer.managers.values())
+
+
+def test_undecodable_item_is_not_half_indexed(tmp_path, monkeypatch):
+    indexer = make_indexer(tmp_path, monkeypatch, dino_fails=False)
+    broken = item("b.jpg", 2)
+    broken["pixels"] = None
+    indexer._index_batch([item("a.jpg", 1), broken])
+
+    assert indexer.indexed_paths == ["a.jpg"] and indexer.failed == 1
+    counts = {name: manager.active_index.ntotal for name, manager in indexer.managers.items()}
+    assert counts == {"phash": 2, "whash": 2, "clip": 1, "dino": 1}
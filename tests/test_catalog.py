@@ -0,0 +1,35 @@
+import faiss
+import numpy as np
+
+from src.core.catalog import ImageCatalog
+from src.core.index_manager import IndexShardManager
+from src.utils import faiss_ops as fi
+
+
+def test_add_many_keeps_ids_per_path(tmp_path):
+    catalog = ImageCatalog(tmp_path / "catalog.sqlite")
+    first = catalog.add_many(["a.jpg", "b.jpg"])
+    assert catalog.add_many(["b.jpg", "c.jpg"])[0] == first[1]
+    assert catalog.get_ids(["a.jpg", "missing.jpg"]) == [first[0], None]
+    assert catalog.get_path(first[0]).endswith("/a.jpg")
+
+
+def test_legacy_shards_migrate_to_catalog_ids(tmp_path):
+    # Shards written before the catalog: no ids, rows line up with <prefix>_paths.npy.
+    paths = [str(tmp_path / f"img{i}.jpg") for i in range(5)]
+    vectors = np.arange(5 * 8, dtype=np.uint8).reshape(5, 8)
+    for suffix_id, (lo, hi) in enumerate([(0, 3), (3, 5)]):
+        legacy = faiss.IndexBinaryFlat(64)
+        legacy.add(vectors[lo:hi])
+        faiss.write_index_binary(legacy, str(tmp_path / f"phash_{suffix_id}.index"))
+    np.save(tmp_path / "phash_paths.npy", np.array(paths, dtype=object), allow_pickle=True)
+
+    catalog = ImageCatalog(tmp_path / "catalog.sqlite")
+    manager = IndexShardManager(str(tmp_path), "phash", 64, index_type="binary", catalog=catalog)
+
+    assert all(fi.has_ids(idx_obj) for idx_obj, _ in manager.indices)
+    for idx_obj, _ in manager.indices:
+        for vector, image_id in zip(fi.reconstruct_all(idx_obj), fi.get_ids(idx_obj)):
+            row = paths.index(catalog.get_path(image_id))
+            assert np.array_equal(vector, vectors[row])
+    assert (tmp_path / "phash_paths.npy.migrated").exists()
@@ -0,0 +1,42 @@
+import glob
+import os
+
+import imagehash
+import numpy as np
+import pytest
+
+from src.utils import fast_hash
+from src.utils import hasher
+
+EXAMPLES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "..", "assets", "examples", "*")))
+
+# Rotated variants are resized after the turn by imagehash and before it by
+# fast_hash, so uint8 rounding can flip a bit or two sitting on the median.
+MAX_ROTATED_BITS = 2
+
+
+@pytest.mark.parametrize("path", EXAMPLES, ids=os.path.basename)
+def test_augmented_hashes_match_imagehash(path):
+    variants = hasher.alter_image(path)
+    hashes = hasher.get_augmented_hashes(path)
+    assert [name for _, _, name in hashes] == list(fast_hash.AUGMENTATIONS)
+
+    for phash, whash, name in hashes:
+        tolerance = MAX_ROTATED_BITS if name.startswith("rotate") else 0
+        assert phash - imagehash.phash(variants[name]) <= tolerance, name
+        assert whash - imagehash.whash(variants[name]) <= tolerance, name
+
+
+@pytest.mark.parametrize("path", EXAMPLES[:2], ids=os.path.basename)
+def test_index_vectors_pack_the_same_bits(path):
+    phash_rows, whash_rows = hasher.get_index_hash_vectors(path)
+    hashes = hasher.get_augmented_hashes(path)
+    assert phash_rows.shape == whash_rows.shape == (len(fast_hash.AUGMENTATIONS), 8)
+    for row, (phash, whash, _) in enumerate(hashes):
+        assert np.array_equal(phash_rows[row], np.packbits(phash.hash.flatten()))
+        assert np.array_equal(whash_rows[row], np.packbits(whash.hash.flatten()))
+
+
+def test_query_mode_keeps_only_the_original():
+    phash_rows, whash_rows = hasher.get_index_hash_vectors(EXAMPLES[0], mode="query")
+    assert phash_rows.shape == whash_rows.shape == (1, 8)
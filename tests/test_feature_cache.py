@@ -0,0 +1,28 @@
+import numpy as np
+
+from src.core.feature_cache import FeatureCache
+
+
+def test_round_trip_and_version_miss(tmp_path):
+    cache = FeatureCache(tmp_path)
+    embedding = np.random.default_rng(0).random((1, 16), dtype=np.float32)
+    cache.put("digest", "dino", embedding, version="v1")
+
+    assert np.array_equal(cache.get("digest", "dino", version="v1"), embedding)
+    assert cache.get("digest", "dino", version="v2") is None
+    assert cache.get("digest", "clip", version="v1") is None
+    cache.close()
+    assert np.array_equal(FeatureCache(tmp_path).get("digest", "dino", version="v1"), embedding)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = FeatureCache(tmp_path, max_bytes=4096, segment_bytes=1024)
+    block = np.zeros(1024, dtype=np.uint8)
+    for i in range(8):
+        cache.put(f"d{i}", "hash", block + i)
+        cache.get("d0", "hash")
+
+    assert cache.total_bytes <= 4096
+    assert np.array_equal(cache.get("d0", "hash"), block)
+    assert cache.get("d1", "hash") is None
+    assert np.array_equal(cache.get("d7", "hash"), block + 7)
@@ -0,0 +1,36 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src import config
+from src.core.bulk_indexer import prepare_image
+from src.utils import hasher as fph
+from src.utils.image_context import ImageContext
+
+EXAMPLES = Path(__file__).resolve().parent.parent / "assets" / "examples"
+
+
+@pytest.fixture
+def large_jpeg(tmp_path):
+    # Big enough that the hash and ORB decodes pick different JPEG scales;
+    # upscaled noise so the two decodes disagree on some hash bits.
+    pixels = np.random.default_rng(2).integers(0, 256, (40, 60, 3), dtype=np.uint8)
+    path = tmp_path / "large.jpg"
+    Image.fromarray(pixels).resize((3200, 2140), Image.BICUBIC).save(path, quality=85)
+    return path
+
+
+@pytest.mark.parametrize("verify", [True, False])
+def test_every_entry_point_hashes_the_same_decode(large_jpeg, monkeypatch, verify):
+    monkeypatch.setattr(config, "CACHE_ENABLED", False)
+    monkeypatch.setattr(config, "VERIFY_ENABLED", verify)
+    for path in [large_jpeg, EXAMPLES / "resized.jpg"]:
+        expected = fph.get_index_hash_vectors(str(path))
+        ctx = ImageContext(path)
+        ctx.rgb
+        item = prepare_image(str(path))
+        for got in (ctx.index_hash_vectors("index"), (item["phash"], item["whash"])):
+            assert np.array_equal(got[0], expected[0]) and np.array_equal(got[1], expected[1])
+        assert ctx.phash == fph.pw_hash(str(path))[0]
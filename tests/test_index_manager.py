@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from src import config
+from src.core.index_manager import IndexShardManager
+
+
+def test_remove_ids_keeps_ivf_ids_aligned(tmp_path, monkeypatch):
+    # IVF lists keep their row numbers after a removal; the shard must still
+    # return the right id for every vector left in it.
+    monkeypatch.setattr(config, "IVF_NLIST", 4)
+    rng = np.random.default_rng(1)
+    vectors = rng.standard_normal((300, 16)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    manager = IndexShardManager(str(tmp_path), "dino", 16, index_type="ivf", train_size=200,
+                                nprobe=4, rerank=False)
+    manager.add(vectors, np.arange(300))
+    manager.maybe_train()
+
+    manager.score_ids(vectors[0], [5, 10])
+    assert manager.remove_ids([10]) == 1
+    assert manager.score_ids(vectors[0], [5, 10]) == pytest.approx({5: float(vectors[5] @ vectors[0])}, abs=1e-5)
+    hits = manager.search_batch(vectors[[11, 299]], k=1)[1]
+    assert hits[:, 0].tolist() == [11, 299]
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf", "ivfpq", "hnsw", "sq8", "pq", "fp16"])
+def test_score_ids_scores_every_requested_id(tmp_path, monkeypatch, index_type):
+    # Without the rerank store, scores come from the shard itself; the ids
+    # least similar to the query are the ones a restricted ANN search drops.
+    monkeypatch.setattr(config, "IVF_NLIST", 8)
+    monkeypatch.setattr(config, "PQ_NBITS", 4)
+    monkeypatch.setattr(config, "IVFPQ_NBITS", 4)
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((1000, 32)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    ids = np.arange(1000, 2000)
+    manager = IndexShardManager(str(tmp_path), "clip", 32, index_type=index_type, train_size=500,
+                                nprobe=1, ef_search=4, rerank=False)
+    manager.add(vectors, ids)
+    manager.maybe_train()
+
+    exact = vectors @ vectors[0]
+    wanted = np.concatenate([ids[:1], ids[np.argsort(exact)[:20]]])
+    scores = manager.score_ids(vectors[0], wanted)
+
+    assert sorted(scores) == sorted(wanted.tolist())
+    tolerance = 0.35 if "pq" in index_type else 0.01
+    for image_id in wanted:
+        assert scores[int(image_id)] == pytest.approx(exact[image_id - 1000], abs=tolerance)
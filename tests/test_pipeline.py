@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from src import config
+from src.core import pipeline
+from src.utils.image_context import ImageContext
+
+
+class FakeDense:
+    # Search results of one dense index: a single neighbour, id 1, at `score`.
+    def __init__(self, score):
+        self.score = score
+        self.searched = False
+
+    def search(self, query_vector, k=1):
+        self.searched = True
+        return [(self.score, 1)]
+
+
+class FakeCatalog:
+    def get_path(self, image_id):
+        return f"/index/{image_id}.jpg"
+
+
+def run_dense_verdict(monkeypatch, dino_score, clip_score):
+    monkeypatch.setattr(config, "VERIFY_ENABLED", False)
+    monkeypatch.setattr(config, "CLIP_CANDIDATE_K", 0)
+    managers = {"dino": FakeDense(dino_score), "clip": FakeDense(clip_score)}
+    monkeypatch.setattr(pipeline, "_managers", managers)
+    monkeypatch.setattr(pipeline, "get_catalog", lambda: FakeCatalog())
+
+    ctx = ImageContext("query.jpg")
+    ctx._embeddings = {"dino": np.ones((1, 4), np.float32), "clip": np.ones((1, 4), np.float32)}
+    result = pipeline.new_result("query.jpg")
+    pipeline.dense_verdict(ctx, result)
+    return result, managers["clip"].searched
+
+
+def test_dino_miss_reports_its_similarity(monkeypatch):
+    monkeypatch.setattr(pipeline, "get_catalog", lambda: FakeCatalog())
+    assert pipeline.dense_hit("dino", 0.40, 1, config.DINO_THRESHOLD) == (False, 40.0, None)
+
+
+@pytest.mark.parametrize("dino_score,clip_score,status,clip_ran", [
+    (0.40, 0.70, "Similar", True),    # ambiguous band, CLIP confirms
+    (0.40, 0.30, "Unique", True),     # ambiguous band, CLIP disagrees
+    (0.10, 0.70, "Unique", False),    # below the band, CLIP never runs
+    (0.80, 0.10, "Similar", False),   # DINO match on its own
+])
+def test_ambiguous_dino_band_goes_to_clip(monkeypatch, dino_score, clip_score, status, clip_ran):
+    result, clip_searched = run_dense_verdict(monkeypatch, dino_score, clip_score)
+    assert result["status"] == status
+    assert clip_searched == clip_ran
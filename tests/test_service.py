@@ -0,0 +1,56 @@
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src import config
+from src.core import pipeline
+from web import service
+
+EXAMPLES = Path(__file__).resolve().parent.parent / "assets" / "examples"
+
+
+def fake_embeddings(vectors):
+    def embed(contexts, engine, kind, embed_many):
+        return [vectors[Path(ctx.path).name][None, :] for ctx in contexts]
+    return embed
+
+
+def upload(tmp_path, name, example):
+    path = tmp_path / name
+    shutil.copy(EXAMPLES / example, path)
+    return str(path)
+
+
+def noise_upload(tmp_path, name, seed):
+    path = tmp_path / name
+    pixels = np.random.default_rng(seed).integers(0, 256, (300, 400, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(path)
+    return str(path)
+
+
+def test_batch_repeats_compares_with_earlier_kept_images(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "CACHE_ENABLED", False)
+    vectors = {"a.jpg": np.array([1.0, 0.0]), "b.jpg": np.array([0.0, 1.0]),
+               "c.jpg": np.array([0.0, 1.0]), "d.jpg": np.array([0.6, 0.8])}
+    monkeypatch.setattr(pipeline, "embed_contexts", fake_embeddings(vectors))
+    paths = [upload(tmp_path, "a.jpg", "compressed.jpg"), noise_upload(tmp_path, "b.jpg", 1),
+             noise_upload(tmp_path, "c.jpg", 2), upload(tmp_path, "d.jpg", "watermark.jpg")]
+
+    repeats = pipeline.batch_repeats(paths)
+    assert repeats[0] is None and repeats[1] is None
+    assert repeats[2][0] == 1 and repeats[2][1]["method"] == "DINO"
+    assert repeats[3][0] == 0 and repeats[3][1]["method"] == "phash & whash"
+
+
+def test_process_removes_uploads_when_the_check_fails(tmp_path, monkeypatch):
+    def fail(paths):
+        raise RuntimeError("index unavailable")
+
+    monkeypatch.setattr(pipeline, "check_images_pipeline", fail)
+    jobs = [service.Job(upload(tmp_path, f"{i}.jpg", "color.jpg"), f"{i}.jpg") for i in range(3)]
+    with pytest.raises(RuntimeError):
+        service.MicroBatcher(max_size=4, max_wait_ms=0).process(jobs)
+    assert not any(Path(job.tmp_path).exists() for job in jobs)
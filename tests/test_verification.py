@@ -0,0 +1,57 @@
+import itertools
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+from src import config
+from src.core.verification_store import VerificationStore
+from src.utils.verification import compare_features, extract_features, extract_query_features, preprocess_image
+
+EXAMPLES = Path(__file__).resolve().parent.parent / "assets" / "examples"
+
+
+def features(img, query=False):
+    data = preprocess_image(img)
+    return extract_query_features(data) if query else extract_features(data)
+
+
+def unrelated_images():
+    rng = np.random.default_rng(0)
+    shapes = np.full((600, 600, 3), 200, np.uint8)
+    for _ in range(40):
+        center = tuple(rng.integers(0, 600, 2).tolist())
+        color = tuple(rng.integers(0, 255, 3).tolist())
+        cv2.circle(shapes, center, int(rng.integers(5, 60)), color, -1)
+    return {
+        "noise1": rng.integers(0, 256, (600, 600, 3), dtype=np.uint8),
+        "noise2": rng.integers(0, 256, (600, 600, 3), dtype=np.uint8),
+        "shapes": shapes,
+        "photo": cv2.imread(str(EXAMPLES / "color.jpg")),
+    }
+
+
+@pytest.mark.parametrize("a,b", list(itertools.combinations(unrelated_images(), 2)))
+def test_unrelated_images_stay_below_threshold(a, b):
+    images = unrelated_images()
+    score = compare_features(features(images[a], query=True), features(images[b]))
+    assert score["total"] < config.HIST_THRESHOLD
+
+
+@pytest.mark.parametrize("name", ["resized.jpg", "cropped.jpg", "watermark.jpg"])
+def test_near_duplicates_reach_threshold(name):
+    original = cv2.imread(str(EXAMPLES / "compressed.jpg"))
+    edited = cv2.imread(str(EXAMPLES / name))
+    score = compare_features(features(edited, query=True), features(original))
+    assert score["total"] >= config.HIST_THRESHOLD
+
+
+def test_store_round_trip_keeps_keypoints(tmp_path):
+    store = VerificationStore(tmp_path / "features.sqlite")
+    original = features(cv2.imread(str(EXAMPLES / "color.jpg")))
+    store.put(7, original)
+    loaded = store.get_many([7])[7]
+    np.testing.assert_array_equal(loaded["points"], original["points"])
+    np.testing.assert_array_equal(loaded["descriptors"], original["descriptors"])
+    store.close()
@@ -0,0 +1,106 @@
+import os
+
+import numpy as np
+
+from src.core.index_manager import IndexShardManager
+from src.core.wal import WriteAheadLog
+from src.utils import faiss_ops as fi
+
+
+def open_wal(root):
+    return WriteAheadLog(root, group_commit_ms=0, fsync=False)
+
+
+def rows(value, count=2):
+    return np.full((count, 8), value, dtype=np.uint8)
+
+
+def test_replay_returns_records_after_the_checkpoint(tmp_path):
+    wal = open_wal(tmp_path)
+    for image_id in (1, 2, 3):
+        wal.append(image_id, {"phash": rows(image_id)})
+    wal.rotate()
+    wal.mark_checkpoint({"phash": 2}, names=["phash"])
+    wal.close()
+
+    wal = open_wal(tmp_path)
+    replayed = list(wal.replay("phash"))
+    assert [(lsn, image_id) for lsn, image_id, _ in replayed] == [(3, 3)]
+    assert np.array_equal(replayed[0][2]["phash"], rows(3))
+    assert wal.lsn == 3
+
+
+def test_torn_tail_is_dropped(tmp_path):
+    wal = open_wal(tmp_path)
+    wal.append(1, {"phash": rows(1)})
+    wal.append(2, {"phash": rows(2)})
+    wal.close()
+    _, path = wal.segments()[-1]
+    with open(path, "ab") as f:
+        f.write(b"\x40\x00\x00\x00partial")
+
+    wal = open_wal(tmp_path)
+    assert [image_id for _, image_id, _ in wal.replay("phash")] == [1, 2]
+    assert wal.append(3, {"phash": rows(3)}) == 3
+    wal.close()
+    assert [image_id for _, image_id, _ in open_wal(tmp_path).replay("phash")] == [1, 2, 3]
+
+
+def test_checkpointed_segments_are_deleted(tmp_path):
+    wal = open_wal(tmp_path)
+    wal.append(1, {"phash": rows(1)})
+    wal.rotate()
+    wal.append(2, {"phash": rows(2)})
+    wal.rotate()
+    wal.mark_checkpoint({"phash": 1, "whash": 2}, names=["phash", "whash"])
+    assert [first for first, _ in wal.segments()] == [2, 3]
+    wal.close()
+
+
+def shard_manager(root):
+    return IndexShardManager(str(root), "phash", 64, index_type="binary", max_vectors=1000)
+
+
+def test_delta_skips_rows_the_shard_file_already_has(tmp_path):
+    manager = shard_manager(tmp_path)
+    manager.add(rows(1), 1)
+    manager.write_snapshot(manager.snapshot())
+    manager.add(rows(2), 2)
+    snapshot = manager.snapshot()
+    # Crash between a full write and removing the delta: both hold image 2.
+    manager.save_active_index()
+    manager.write_snapshot(snapshot)
+    assert os.path.exists(manager.get_delta_filename(0))
+
+    ids = fi.get_ids(shard_manager(tmp_path).active_index)
+    assert sorted(ids.tolist()) == [1, 1, 2, 2]
+    assert not os.path.exists(manager.get_delta_filename(0))
+
+
+def test_delta_replays_removals_in_order(tmp_path):
+    manager = shard_manager(tmp_path)
+    manager.add(rows(1), 1)
+    manager.save_active_index()
+    manager.remove_ids([1])
+    manager.add(rows(9), 1)
+    manager.write_snapshot(manager.snapshot())
+
+    reloaded = shard_manager(tmp_path).active_index
+    assert fi.get_ids(reloaded).tolist() == [1, 1]
+    assert np.array_equal(fi.reconstruct_all(reloaded), rows(9))
+
+
+def test_replay_of_a_reindexed_file_replaces_its_rows(tmp_path, monkeypatch):
+    from src.core import pipeline
+
+    manager = shard_manager(tmp_path / "indices")
+    manager.add(rows(1), 1)
+    manager.save_active_index()
+    wal = open_wal(tmp_path / "wal")
+    wal.append(1, {"phash": rows(9), "replaces": np.uint8(1)})
+    monkeypatch.setattr(pipeline, "get_wal", lambda: wal)
+
+    pipeline.replay_wal("phash", manager)
+    assert fi.get_ids(manager.active_index).tolist() == [1, 1]
+    assert np.array_equal(fi.reconstruct_all(manager.active_index), rows(9))
+    wal.close()
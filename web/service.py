@@ -0,0 +1,246 @@
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import asyncio
+import argparse
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from aiohttp import web
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+
+from src import config
+from src.core import pipeline
+
+
+def store_unique(tmp_path, filename):
+    # Same policy as web/api_bridge.run_ndid: keep unique uploads and index them.
+    base, ext = os.path.splitext(os.path.basename(filename))
+    perm_path = config.UPLOAD_DIR / f"{base}{ext}"
+    counter = 1
+    while perm_path.exists():
+        perm_path = config.UPLOAD_DIR / f"{base}_{counter}{ext}"
+        counter += 1
+    shutil.move(tmp_path, str(perm_path))
+    if pipeline.add_to_indices(str(perm_path)):
+        print(f"Unique image detected. Added {perm_path} to indices.")
+    else:
+        print(f"Failed to add {perm_path} to indices.")
+    return str(perm_path)
+
+
+class Job:
+    def __init__(self, tmp_path, filename):
+        self.id = uuid.uuid4().hex
+        self.tmp_path = tmp_path
+        self.filename = filename
+        self.status = "queued"
+        self.result = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.done = asyncio.Event()
+
+    def to_dict(self):
+        return {"job_id": self.id, "status": self.status, "filename": self.filename,
+                "created_at": self.created_at, "finished_at": self.finished_at, "result": self.result}
+
+
+class MicroBatcher:
+    """
+    Collects queued jobs for up to max_wait after the first arrival (or until
+    max_size) and hands each batch to one worker thread. Detection and index
+    updates share that thread, so the faiss indices and models are never
+    used concurrently.
+    """
+
+    def __init__(self, max_size=None, max_wait_ms=None):
+        self.max_size = max_size or config.BATCH_MAX_SIZE
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else config.BATCH_MAX_WAIT_MS) / 1000.0
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="detector")
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+        self.executor.shutdown(wait=False)
+
+    async def submit(self, job):
+        await self.queue.put(job)
+
+    async def next_batch(self):
+        batch = [await self.queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.max_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self.next_batch()
+            for job in batch:
+                job.status = "running"
+            try:
+                results = await loop.run_in_executor(self.executor, self.process, batch)
+            except Exception as e:
+                print(f"Error in detection batch: {e}")
+                results = [{"status": "Error", "error": str(e), "method": "N/A",
+                            "similarity_percentage": 0.0, "matched_image_path": None} for _ in batch]
+            for job, result in zip(batch, results):
+                job.result = result
+                job.status = "failed" if result.get("status") == "Error" else "done"
+                job.finished_at = time.time()
+                job.done.set()
+
+    def process(self, batch):
+        # The batch is checked against the index as it was before any of it was
+        # stored; its Unique uploads are then compared with the ones stored
+        # ahead of them, so of two copies of a new image only the first is kept.
+        try:
+            results = pipeline.check_images_pipeline([job.tmp_path for job in batch])
+            unique = [i for i, result in enumerate(results) if result["status"] == "Unique" and "error" not in result]
+            repeats = pipeline.batch_repeats([batch[i].tmp_path for i in unique])
+            for i, repeat in zip(unique, repeats):
+                if repeat is None:
+                    results[i]["stored_path"] = store_unique(batch[i].tmp_path, batch[i].filename)
+                else:
+                    earlier, fields = repeat
+                    results[i].update(fields, matched_image_path=results[unique[earlier]]["stored_path"])
+            for job, result in zip(batch, results):
+                result["source_image_path"] = job.filename
+            return results
+        finally:
+            # Stored uploads were moved away; everything else is removed, also when the check raised.
+            for job in batch:
+                if os.path.exists(job.tmp_path):
+                    os.remove(job.tmp_path)
+
+
+def to_builtin(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Not JSON serializable: {type(value)}")
+
+
+def json_response(data, status=200):
+    return web.json_response(data, status=status, dumps=lambda d: json.dumps(d, default=to_builtin))
+
+
+async def read_upload(request):
+    # Accepts multipart (field "image") or a raw image body with ?filename=
+    if request.content_type.startswith("multipart/"):
+        reader = await request.multipart()
+        async for part in reader:
+            if part.name == "image":
+                filename = part.filename or "upload.jpg"
+                data = await part.read()
+                break
+        else:
+            raise web.HTTPBadRequest(text="multipart field 'image' is required")
+    else:
+        filename = request.query.get("filename", "upload.jpg")
+        data = await request.read()
+    if not data:
+        raise web.HTTPBadRequest(text="empty upload")
+
+    fd, tmp_path = tempfile.mkstemp(suffix=os.path.splitext(filename)[1] or ".jpg")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    return tmp_path, filename
+
+
+def remember(app, job):
+    jobs = app["jobs"]
+    jobs[job.id] = job
+    while len(jobs) > config.JOB_HISTORY:
+        jobs.popitem(last=False)
+
+
+async def create_job(request):
+    tmp_path, filename = await read_upload(request)
+    job = Job(tmp_path, filename)
+    remember(request.app, job)
+    await request.app["batcher"].submit(job)
+
+    if request.query.get("wait") in ("1", "true"):
+        await job.done.wait()
+        return json_response(job.to_dict())
+    return json_response(job.to_dict(), status=202)
+
+
+async def check(request):
+    tmp_path, filename = await read_upload(request)
+    job = Job(tmp_path, filename)
+    remember(request.app, job)
+    await request.app["batcher"].submit(job)
+    await job.done.wait()
+    return json_response(job.result)
+
+
+async def get_job(request):
+    job = request.app["jobs"].get(request.match_info["job_id"])
+    if job is None:
+        raise web.HTTPNotFound(text="unknown job")
+    return json_response(job.to_dict())
+
+
+async def health(request):
+    return json_response({"status": "ok", "queued": request.app["batcher"].queue.qsize()})
+
+
+async def on_startup(app):
+    batcher = app["batcher"]
+    await asyncio.get_running_loop().run_in_executor(batcher.executor, pipeline.warm_up)
+    batcher.start()
+
+
+async def on_cleanup(app):
+    await app["batcher"].stop()
+
+
+def create_app(max_batch=None, max_wait_ms=None):
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app["jobs"] = OrderedDict()
+    app["batcher"] = MicroBatcher(max_batch, max_wait_ms)
+    app.router.add_post("/jobs", create_job)
+    app.router.add_get("/jobs/{job_id}", get_job)
+    app.router.add_post("/check", check)
+    app.router.add_get("/health", health)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Async DejaView detection service with micro-batching.")
+    parser.add_argument("--host", default=config.SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=config.SERVICE_PORT)
+    parser.add_argument("--max-batch", type=int, default=config.BATCH_MAX_SIZE, help="Max images per batch")
+    parser.add_argument("--max-wait-ms", type=float, default=config.BATCH_MAX_WAIT_MS,
+                        help="How long the first request in a batch waits for company")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    web.run_app(create_app(args.max_batch, args.max_wait_ms), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()